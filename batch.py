@@ -0,0 +1,218 @@
+"""Пакетный рендер по манифесту без UI.
+
+Манифест — JSON (список объектов) или CSV с колонками:
+clips, audio, heading, name1, name2, date и необязательной output.
+В CSV клипы перечисляются в одной ячейке через «;». Относительные пути
+считаются от папки манифеста.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import click
+
+import pipeline
+from render_cache import file_hash, link_or_copy
+from workspace import create_workspace
+
+STAMP_SUFFIX = ".stamp.json"  # рядом с результатом: отпечаток входов, по которому строка пропускается
+
+logger = logging.getLogger(__name__)
+
+
+def read_manifest(path):
+    """Прочитать манифест (JSON или CSV) в список строк-словарей с абсолютными путями"""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = json.load(f)
+    if not isinstance(rows, list):
+        raise Exception("Манифест должен быть списком строк")
+
+    result = []
+    for n, row in enumerate(rows, 1):
+        clips = row.get("clips") or []
+        if isinstance(clips, str):
+            clips = [c.strip() for c in clips.split(";") if c.strip()]
+        if not clips:
+            raise Exception(f"Строка {n}: не указаны клипы")
+        audio = (row.get("audio") or "").strip()
+        result.append({
+            "row": n,
+            "clips": [os.path.join(base, c) for c in clips],
+            "audio": os.path.join(base, audio) if audio else None,
+            # Пустые хвостовые поля CSV DictReader отдаёт как None — на видео не должно попасть «None»
+            "heading": row.get("heading") or "",
+            "name1": row.get("name1") or "",
+            "name2": row.get("name2") or "",
+            "date": row.get("date") or "",
+            "output": os.path.join(base, row["output"]) if row.get("output") else None,
+        })
+    return result
+
+
+def row_inputs(row):
+    """Входные файлы строки; ошибка, если какого-то нет"""
+    paths = [*row["clips"], *([row["audio"]] if row["audio"] else [])]
+    for path in paths:
+        if not os.path.isfile(path):
+            raise Exception(f"Файл не найден: {path}")
+    return paths
+
+
+def row_stamp(row, profile, engine):
+    """Отпечаток строки: тексты, настройки профиля, (путь, размер, mtime) входных файлов
+    и содержимое оверлея и шрифта — их замена тоже требует перерендера"""
+    files = []
+    for path in row_inputs(row):
+        st = os.stat(path)
+        files.append([os.path.abspath(path), st.st_size, st.st_mtime_ns])
+    font = pipeline.get_font_path()
+    data = {
+        "text": [row["heading"], row["name1"], row["name2"], row["date"]],
+        "files": files,
+        "overlay": file_hash(pipeline.OVERLAY_FILE) if os.path.exists(pipeline.OVERLAY_FILE) else None,
+        "font": [font, file_hash(font) if font and os.path.exists(font) else None],
+        "profile": profile,
+        "encode": pipeline.get_encode_profile(profile),
+        "engine": engine,
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def is_up_to_date(output, stamp):
+    """Результат уже отрендерен из тех же входов с теми же параметрами"""
+    try:
+        with open(output + STAMP_SUFFIX) as f:
+            return os.path.exists(output) and json.load(f).get("stamp") == stamp
+    except (OSError, ValueError):
+        return False
+
+
+def get_batch_root():
+    """Рабочие директории строк — отдельно от workspaces/, которые UI чистит по TTL и квоте"""
+    return os.path.join(pipeline.WORK_DIR, "batch")
+
+
+def render_row(row, profile, engine, max_workers=None, progress_callback=None):
+    """Отрендерить одну строку манифеста в отдельной рабочей директории"""
+    work_dir = create_workspace(get_batch_root())
+    try:
+        row_inputs(row)
+        for i, clip in enumerate(row["clips"], 1):
+            link_or_copy(clip, os.path.join(work_dir, "video", f"source{i}.mp4"))
+        if row["audio"]:
+            link_or_copy(row["audio"], os.path.join(work_dir, "audio", "voice.mp3"))
+
+        final = pipeline.process_videos(
+            row["heading"], row["name1"], row["name2"], row["date"],
+            progress_callback or (lambda m: None),
+            max_workers=max_workers, engine=engine, profile=profile, work_dir=work_dir,
+        )
+        os.makedirs(os.path.dirname(row["output"]), exist_ok=True)
+        shutil.move(final, row["output"])
+        return row["output"]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_manifest(rows, output_dir, jobs=1, max_workers=None, profile=pipeline.DEFAULT_PROFILE,
+                 engine="parts", force=False):
+    """Отрендерить строки манифеста, по jobs одновременно. Возвращает список результатов"""
+    for row in rows:
+        row["output"] = row["output"] or os.path.join(output_dir, f"row_{row['row']:04d}.mp4")
+    # Частей внутри строки рендерим меньше, чтобы строки вместе не превышали число ядер
+    if max_workers is None:
+        max_workers = max(1, pipeline.get_default_workers(profile) // jobs)
+
+    def run(row):
+        start = time.perf_counter()
+        result = {"row": row["row"], "output": row["output"]}
+        try:
+            stamp = row_stamp(row, profile, engine)
+            if not force and is_up_to_date(row["output"], stamp):
+                result["status"] = "skipped"
+            else:
+                render_row(row, profile, engine, max_workers)
+                with open(row["output"] + STAMP_SUFFIX, "w") as f:
+                    json.dump({"stamp": stamp}, f)
+                result["status"] = "done"
+                result["duration"] = pipeline.get_duration(row["output"])
+        except Exception as e:
+            logger.error(f"Строка {row['row']}: {e}")
+            result["status"] = "failed"
+            result["error"] = str(e)
+        result["seconds"] = round(time.perf_counter() - start, 2)
+        return result
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [pool.submit(run, row) for row in rows]
+        for fut in as_completed(futures):
+            r = fut.result()
+            results.append(r)
+            print(f"[{len(results)}/{len(rows)}] строка {r['row']}: {r['status']} "
+                  f"({r.get('seconds', 0):.1f} с) {r.get('error', r['output'])}")
+    return sorted(results, key=lambda r: r["row"])
+
+
+def summarize(results, elapsed):
+    """Итог пакета: число строк по статусам и производительность"""
+    done = [r for r in results if r["status"] == "done"]
+    video_seconds = sum(r.get("duration", 0.0) for r in done)
+    summary = {
+        "rows": len(results),
+        "done": len(done),
+        "skipped": sum(1 for r in results if r["status"] == "skipped"),
+        "failed": sum(1 for r in results if r["status"] == "failed"),
+        "seconds": round(elapsed, 2),
+        "rows_per_minute": round(len(done) / elapsed * 60, 2) if elapsed else 0.0,
+        "video_seconds": round(video_seconds, 2),
+        "realtime_factor": round(video_seconds / elapsed, 2) if elapsed else 0.0,
+    }
+    print(f"Готово {summary['done']}, пропущено {summary['skipped']}, ошибок {summary['failed']} "
+          f"за {elapsed:.1f} с: {summary['rows_per_minute']} видео/мин, "
+          f"{summary['video_seconds']:.0f} с видео ({summary['realtime_factor']}x реального времени)")
+    return summary
+
+
+@click.command()
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False))
+@click.option("--output-dir", default="output", show_default=True, type=click.Path(file_okay=False),
+              help="Куда класть результаты строк без колонки output")
+@click.option("--jobs", default=1, show_default=True, help="Строк, которые рендерятся одновременно")
+@click.option("--workers", type=int, help="Параллельных частей внутри строки (по умолчанию ядра / jobs)")
+@click.option("--profile", default=pipeline.DEFAULT_PROFILE, show_default=True,
+              type=click.Choice(list(pipeline.ENCODE_PROFILES)), help="Профиль кодирования")
+@click.option("--engine", default="parts", show_default=True, type=click.Choice(["parts", "single", "pipe"]))
+@click.option("--force", is_flag=True, help="Рендерить и актуальные строки")
+@click.option("--report", type=click.Path(dir_okay=False), help="Сохранить результаты и итог в JSON")
+def cli(manifest, output_dir, jobs, workers, profile, engine, force, report):
+    """Отрендерить все строки манифеста MANIFEST"""
+    logging.basicConfig(level=logging.WARNING)
+    if not pipeline.check_ffmpeg_available():
+        print("❌ FFmpeg недоступен")
+        sys.exit(1)
+
+    rows = read_manifest(manifest)
+    start = time.perf_counter()
+    results = run_manifest(rows, os.path.abspath(output_dir), jobs, workers, profile, engine, force)
+    summary = summarize(results, time.perf_counter() - start)
+
+    if report:
+        with open(report, "w") as f:
+            json.dump({"summary": summary, "results": results}, f, indent=2, ensure_ascii=False)
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
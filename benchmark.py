@@ -0,0 +1,669 @@
+"""Бенчмарки рендера на синтетических данных (без загрузки реальных видео)"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import threading
+import subprocess
+
+import click
+
+import pipeline
+import metrics
+from render_cache import link_or_copy
+
+# Эталонный набор клипов: (размер, длительность в секундах)
+REFERENCE_CLIPS = [("640x360", 10), ("1280x720", 10), ("1920x1080", 10)]
+
+# Сценарии набора suite: клипы (размер, длительность) и длина озвучки (0 — без неё)
+SUITE_SCENARIOS = [
+    {"name": "360p-1clip", "clips": [("640x360", 10)], "audio": 0},
+    {"name": "720p-3clips", "clips": [("1280x720", 10)] * 3, "audio": 0},
+    {"name": "1080p-3clips-voice", "clips": [("1920x1080", 10)] * 3, "audio": 20},
+    {"name": "mixed-voice-loop", "clips": [("640x360", 5), ("1280x720", 5), ("1920x1080", 5)], "audio": 40},
+    {"name": "720p-6clips-short-voice", "clips": [("1280x720", 5)] * 6, "audio": 12},
+]
+SEAM_MIN_PSNR = 30.0  # дБ: ниже — кадры на стыке сегментов сдвинуты или испорчены
+SAMPLE_INTERVAL = 0.1  # период замера RSS и временных файлов, с
+OUTPUT_FPS = 25  # generate_clip пишет 25 кадров/с
+
+
+def generate_clip(path, size, duration, rate=25, gop=None):
+    """Сгенерировать синтетический клип testsrc2 + синус (gop — интервал ключевых кадров в кадрах)"""
+    subprocess.run([
+        pipeline.FFMPEG_PATH, "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate={rate}:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast", *(["-g", str(gop)] if gop else []),
+        "-c:a", "aac", "-shortest", path,
+    ], check=True, capture_output=True)
+
+
+def generate_audio(path, duration):
+    """Сгенерировать синтетическую озвучку (синус, mp3)"""
+    subprocess.run([
+        pipeline.FFMPEG_PATH, "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"sine=frequency=220:duration={duration}",
+        "-c:a", "libmp3lame", path,
+    ], check=True, capture_output=True)
+
+
+def prepare_reference_clips(work_dir, clips=REFERENCE_CLIPS):
+    """Положить эталонные клипы в work_dir/video как source*.mp4"""
+    video_dir = os.path.join(work_dir, "video")
+    os.makedirs(video_dir, exist_ok=True)
+    for i, (size, duration) in enumerate(clips):
+        generate_clip(os.path.join(video_dir, f"source{i+1}.mp4"), size, duration)
+
+
+def bench_profiles(profiles, work_dir):
+    """Отрендерить эталонный набор каждым профилем, замерить время и размер"""
+    results = []
+    for name in profiles:
+        start = time.perf_counter()
+        final = pipeline.process_videos("HELLO", "Name", "Place", "2026", lambda m: None,
+                                        use_cache=False, profile=name, work_dir=work_dir)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(final)
+        results.append({"profile": name, "seconds": round(elapsed, 2), "bytes": size})
+        print(f"{name:10s} {elapsed:8.2f} с {size / (1024 * 1024):8.2f} МБ")
+    return results
+
+
+def bench_variants(count, work_dir, profile=pipeline.DEFAULT_PROFILE):
+    """N вариантов текста: N последовательных process_videos против одного process_variants"""
+    variants = [{"heading": "HELLO", "name1": f"Name {k+1}", "name2": "Place", "datetext": "2026"}
+                for k in range(count)]
+
+    start = time.perf_counter()
+    for v in variants:
+        pipeline.process_videos(v["heading"], v["name1"], v["name2"], v["datetext"], lambda m: None,
+                                use_cache=False, profile=profile, work_dir=work_dir)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pipeline.process_variants(variants, lambda m: None, use_cache=False, profile=profile, work_dir=work_dir)
+    fanout = time.perf_counter() - start
+
+    results = {"variants": count, "profile": profile, "sequential_seconds": round(sequential, 2),
+               "variants_seconds": round(fanout, 2), "speedup": round(sequential / fanout, 2)}
+    print(f"{count} вариантов: последовательно {sequential:.2f} с, одним рендером {fanout:.2f} с "
+          f"(x{results['speedup']})")
+    return results
+
+
+def bench_preview(work_dir, profile=pipeline.DEFAULT_PROFILE):
+    """Превью кадра и видео (первый рендер и из кэша) против полного рендера"""
+    results = {}
+    for name, seconds in (("frame", 0), ("video", pipeline.PREVIEW_SECONDS)):
+        for attempt in ("cold", "cached"):
+            start = time.perf_counter()
+            pipeline.render_preview("HELLO", "Name", "Place", "2026", work_dir, seconds=seconds)
+            results[f"{name}_{attempt}_s"] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    pipeline.process_videos("HELLO", "Name", "Place", "2026", lambda m: None, use_cache=False,
+                            profile=profile, work_dir=work_dir)
+    results["full_render_s"] = round(time.perf_counter() - start, 3)
+    print(f"кадр {results['frame_cold_s']:.2f} с (из кэша {results['frame_cached_s']:.3f} с), "
+          f"видео {results['video_cold_s']:.2f} с (из кэша {results['video_cached_s']:.3f} с), "
+          f"полный рендер {results['full_render_s']:.2f} с")
+    return results
+
+
+def _rss_bytes(pid):
+    """Текущий RSS процесса по /proc (0, если процесс уже завершился)"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _child_pids(pid):
+    """Прямые потомки процесса (процессы ffmpeg) по /proc/*/stat"""
+    children = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                # после имени процесса в скобках: состояние, ppid
+                if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                    children.append(int(name))
+        except (OSError, ValueError, IndexError):
+            continue
+    return children
+
+
+def sample_resources(stop_event, peaks, output=None):
+    """Пока не выставлен stop_event, обновлять в peaks пик RSS (Python + ffmpeg)
+    и момент появления первых байт output (peaks["first_output"], perf_counter)"""
+    pid = os.getpid()
+    while True:
+        rss = _rss_bytes(pid) + sum(_rss_bytes(child) for child in _child_pids(pid))
+        peaks["rss"] = max(peaks.get("rss", 0), rss)
+        if output and "first_output" not in peaks and os.path.exists(output) and os.path.getsize(output):
+            peaks["first_output"] = time.perf_counter()
+        if stop_event.wait(SAMPLE_INTERVAL):
+            break
+
+
+def prepare_scenario(scenario, work_dir, clip_cache):
+    """Входные файлы сценария в work_dir; клипы генерируются один раз на набор"""
+    for i, (size, duration) in enumerate(scenario["clips"]):
+        src = os.path.join(clip_cache, f"{size}_{duration}.mp4")
+        if not os.path.exists(src):
+            generate_clip(src, size, duration)
+        link_or_copy(src, os.path.join(work_dir, "video", f"source{i+1}.mp4"))
+    if scenario["audio"]:
+        src = os.path.join(clip_cache, f"voice_{scenario['audio']}.mp3")
+        if not os.path.exists(src):
+            generate_audio(src, scenario["audio"])
+        link_or_copy(src, os.path.join(work_dir, "audio", "voice.mp3"))
+
+
+def run_scenario(scenario, work_dir, profile, engine):
+    """Прогнать сценарий целиком и по этапам: время, fps, пиковый RSS, временные файлы, размер"""
+    records = []
+    peaks = {}
+    stop_event = threading.Event()
+    sampler = threading.Thread(target=sample_resources, daemon=True,
+                               args=(stop_event, peaks, os.path.join(work_dir, "youtube_ready.mp4")))
+
+    start = time.perf_counter()
+    sampler.start()
+    try:
+        final = pipeline.process_videos("HELLO", "Name", "Place", "2026", lambda m: None, use_cache=False,
+                                        profile=profile, engine=engine, work_dir=work_dir,
+                                        stage_metrics=records)
+    finally:
+        wall = time.perf_counter() - start
+        stop_event.set()
+        sampler.join()
+
+    duration = pipeline.get_duration(final)
+    job = next(r for r in records if r["stage"] == metrics.JOB_STAGE)
+    stages = {}
+    for r in records:
+        if r["stage"] == metrics.JOB_STAGE:
+            continue
+        stages[r["stage"]] = {"wall_s": r["wall_s"], "cpu_s": r["cpu_s"], "output_bytes": r["output_bytes"]}
+    input_frames = sum(d for _, d in scenario["clips"]) * OUTPUT_FPS
+    if "parts" in stages and stages["parts"]["wall_s"]:
+        stages["parts"]["fps"] = round(input_frames / stages["parts"]["wall_s"], 1)
+
+    return {
+        "scenario": scenario["name"],
+        "clips": len(scenario["clips"]),
+        "audio_s": scenario["audio"],
+        "profile": profile,
+        "engine": engine,
+        "wall_s": round(wall, 3),
+        # от старта до первых байт результата: сколько ждёт этап, который его читает
+        "first_output_s": round(peaks.get("first_output", start + wall) - start, 3),
+        "fps": round(duration * OUTPUT_FPS / wall, 1),
+        "peak_rss_mb": round(peaks.get("rss", 0) / 1024 ** 2, 1),
+        "scratch": job["scratch"],
+        "peak_temp_bytes": job["peak_scratch_bytes"],
+        # промежуточные файлы, записанные на диск: слой, части, склейка с перекодированием
+        "temp_bytes_written": sum(r["output_bytes"] for r in records if r["stage"] in ("layer", "parts", "concat")),
+        "output_bytes": os.path.getsize(final),
+        "output_s": round(duration, 3),
+        "stages": stages,
+    }
+
+
+def bench_suite(scenarios, profile, engine, repeat, root):
+    """Прогнать сценарии suite repeat раз; каждый прогон в чистой рабочей директории"""
+    clip_cache = os.path.join(root, "inputs")
+    os.makedirs(clip_cache, exist_ok=True)
+    results = []
+    for scenario in scenarios:
+        for n in range(repeat):
+            work_dir = os.path.join(root, f"{scenario['name']}_{n}")
+            for folder in ["video", "audio"]:
+                os.makedirs(os.path.join(work_dir, folder), exist_ok=True)
+            prepare_scenario(scenario, work_dir, clip_cache)
+            r = run_scenario(scenario, work_dir, profile, engine)
+            r["run"] = n + 1
+            results.append(r)
+            shutil.rmtree(work_dir, ignore_errors=True)
+            print(f"{r['scenario']:26s} {r['wall_s']:8.2f} с (первые байты {r['first_output_s']:.2f} с) "
+                  f"{r['fps']:7.1f} fps {r['peak_rss_mb']:7.0f} МБ RSS "
+                  f"{r['peak_temp_bytes'] / 1024 ** 2:7.1f} МБ temp {r['output_bytes'] / 1024 ** 2:7.2f} МБ")
+    return results
+
+
+def ffmpeg_version():
+    """Первая строка ffmpeg -version (из проверки FFmpeg, без запуска)"""
+    tools = pipeline.get_ffmpeg_tools()
+    return tools["ffmpeg"]["version"] if tools else ""
+
+
+# Замер запуска в новом процессе: импорт конвейера и проверка FFmpeg
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import pipeline
+imported = time.perf_counter()
+ok = pipeline.check_ffmpeg_available()
+checked = time.perf_counter()
+print(json.dumps({"import_s": imported - start, "check_s": checked - imported, "ok": ok,
+                  "pil_loaded": "PIL" in sys.modules}))
+"""
+
+# Замер перезапусков страницы Streamlit (AppTest): первый прогон и последующие
+RERUN_SCRIPT = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=60)
+start = time.perf_counter()
+at.run()
+first = time.perf_counter() - start
+reruns = []
+for _ in range(int(sys.argv[2])):
+    start = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - start)
+print(json.dumps({"first_run_s": first, "rerun_s": reruns, "errors": [e.value for e in at.error]}))
+"""
+
+
+def _run_script(script, root, *args):
+    """Выполнить script в новом интерпретаторе с cwd=root (там же WORK_DIR) и вернуть его JSON"""
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [package_dir, os.environ.get("PYTHONPATH")])),
+           "REPLICATOR_JOB_WORKERS": "0"}
+    result = subprocess.run([sys.executable, "-c", script, *args], cwd=root, env=env,
+                            capture_output=True, text=True, timeout=300)
+    if result.returncode != 0:
+        raise Exception(f"Замер запуска завершился ошибкой: {result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def bench_startup(repeat, reruns, root):
+    """Холодный запуск без сохранённой записи о FFmpeg и с ней; первый прогон и перезапуски страницы"""
+    record = os.path.join(root, os.path.basename(pipeline.WORK_DIR), pipeline.TOOLS_FILE)
+    results = {}
+    for mode in ("no_record", "record"):
+        runs = []
+        for _ in range(repeat):
+            if mode == "no_record" and os.path.exists(record):
+                os.remove(record)
+            runs.append(_run_script(STARTUP_SCRIPT, root))
+        if not all(r["ok"] for r in runs):
+            raise Exception("FFmpeg недоступен в новом процессе")
+        results[mode] = {key: round(min(r[key] for r in runs), 4) for key in ("import_s", "check_s")}
+        results[mode]["pil_loaded"] = any(r["pil_loaded"] for r in runs)
+        print(f"{mode:10s} импорт {results[mode]['import_s'] * 1000:7.1f} мс, "
+              f"проверка FFmpeg {results[mode]['check_s'] * 1000:7.1f} мс")
+
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    page = _run_script(RERUN_SCRIPT, root, app, str(reruns))
+    if page["errors"]:
+        raise Exception(f"Страница с ошибкой: {page['errors']}")
+    results["page"] = {"first_run_s": round(page["first_run_s"], 4),
+                       "rerun_s_mean": round(sum(page["rerun_s"]) / len(page["rerun_s"]), 4)}
+    print(f"страница   первый прогон {results['page']['first_run_s'] * 1000:7.1f} мс, "
+          f"перезапуск {results['page']['rerun_s_mean'] * 1000:7.1f} мс")
+    return results
+
+
+def stream_end(path, stream):
+    """Число кадров и время конца потока stream ("v" или "a"), декодируя его в null"""
+    result = subprocess.run([
+        pipeline.FFMPEG_PATH, "-v", "error", "-i", path, "-map", f"0:{stream}:0",
+        "-progress", "pipe:1", "-nostats", "-f", "null", "-",
+    ], capture_output=True, text=True, check=True)
+    values = dict(line.split("=", 1) for line in result.stdout.splitlines() if "=" in line)
+    return int(values.get("frame", 0)), int(values.get("out_time_us", 0)) / 1e6
+
+
+def frame_psnr(path, reference):
+    """PSNR каждого кадра path относительно reference (дБ, inf — кадры совпадают)"""
+    result = subprocess.run([
+        pipeline.FFMPEG_PATH, "-v", "error", "-i", path, "-i", reference,
+        "-lavfi", "[0:v][1:v]psnr=stats_file=-", "-f", "null", "-",
+    ], capture_output=True, text=True, check=True)
+    values = []
+    for line in result.stdout.splitlines():
+        fields = dict(item.split(":", 1) for item in line.split() if ":" in item)
+        if "psnr_avg" in fields:
+            values.append(float(fields["psnr_avg"]))
+    return values
+
+
+def bench_segments(duration, segment_seconds, workers, work_dir, profile, size="1280x720", gop=None,
+                   rate=25, target_rate=None):
+    """Рендер длинного клипа сегментами против одного процесса: время, стыки, рассинхрон
+
+    target_rate — частота двух коротких клипов, добавляемых после длинного: она
+    становится общей, и длинный клип рендерится с приведением частоты (fps=).
+    """
+    clip = os.path.join(work_dir, "video", "source1.mp4")
+    generate_clip(clip, size, duration, rate=rate, gop=gop)
+    if target_rate and target_rate != rate:
+        for i in (2, 3):
+            generate_clip(os.path.join(work_dir, "video", f"source{i}.mp4"), size, 1, rate=target_rate)
+    fps = pipeline.target_fps([pipeline.probe_media(p) for p in pipeline.find_videos(work_dir)])
+    converted = fps if pipeline.probe_media(clip)["video"]["fps"] != fps else None
+    segments = pipeline.plan_segments(pipeline.keyframe_times(clip), duration, segment_seconds, converted)
+    boundaries = [round(start * fps) for start, _ in segments[1:]]
+
+    outputs = {}
+    times = {}
+    for name, seconds in [("whole", 0), ("segmented", segment_seconds)]:
+        start = time.perf_counter()
+        final = pipeline.process_videos("HELLO", "Name", "Place", "2026", lambda m: None, max_workers=workers,
+                                        use_cache=False, profile=profile, work_dir=work_dir,
+                                        segment_seconds=seconds)
+        times[name] = time.perf_counter() - start
+        outputs[name] = os.path.join(work_dir, f"{name}.mp4")
+        os.replace(final, outputs[name])
+
+    ends = {name: {s: stream_end(path, s) for s in ("v", "a")} for name, path in outputs.items()}
+    psnr = frame_psnr(outputs["segmented"], outputs["whole"])
+    seam_psnr = [psnr[i] for b in boundaries for i in (b - 1, b, b + 1) if 0 <= i < len(psnr)]
+    # Рассинхрон: разница концов видео и звука по сравнению с рендером одним процессом
+    drift = lambda e: e["a"][1] - e["v"][1]
+    results = {
+        "duration": duration,
+        "segment_seconds": segment_seconds,
+        "segments": len(segments),
+        "workers": workers,
+        "whole_seconds": round(times["whole"], 2),
+        "segmented_seconds": round(times["segmented"], 2),
+        "frames": {name: e["v"][0] for name, e in ends.items()},
+        "av_drift_delta_s": round(drift(ends["segmented"]) - drift(ends["whole"]), 3),
+        "min_psnr": min(psnr) if psnr else None,
+        "min_seam_psnr": min(seam_psnr) if seam_psnr else None,
+    }
+    frame_time = 1 / fps
+    results["ok"] = (
+        results["frames"]["segmented"] == results["frames"]["whole"]
+        and abs(results["av_drift_delta_s"]) < frame_time
+        and bool(psnr) and min(psnr) >= SEAM_MIN_PSNR
+    )
+    print(f"{duration} с, {len(segments)} сегментов по ~{segment_seconds} с, {workers} процесса: "
+          f"одним процессом {times['whole']:.2f} с, сегментами {times['segmented']:.2f} с")
+    print(f"Кадров: {results['frames']['whole']} / {results['frames']['segmented']}, "
+          f"рассинхрон {results['av_drift_delta_s']:+.3f} с, PSNR мин. {results['min_psnr']} дБ, "
+          f"на стыках {results['min_seam_psnr']} дБ — {'OK' if results['ok'] else 'ОШИБКА'}")
+    return results
+
+
+# Загрузка в процессе Streamlit: байты лежат в менеджере загрузок, приложение получает
+# UploadedFile. buffer — прежний код (f.write(v.getbuffer()), загрузчик не пересоздаётся
+# и файл остаётся в менеджере), stream — save_upload и освобождение файла, как после
+# пересоздания загрузчика (браузер удаляет файл старого виджета).
+UPLOAD_SCRIPT = """
+import gc, json, resource
+from streamlit.proto.Common_pb2 import FileURLs
+from streamlit.runtime.memory_uploaded_file_manager import MemoryUploadedFileManager
+from streamlit.runtime.uploaded_file_manager import UploadedFile, UploadedFileRec
+import pipeline
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+baseline = rss_mb()
+manager = MemoryUploadedFileManager("/_stcore/upload_file")
+manager.add_file("session", UploadedFileRec("file", "clip.mp4", "video/mp4", b"\\x01" * ({size_mb} * 2 ** 20)))
+uploaded = rss_mb()
+upload = UploadedFile(manager.get_files("session", ["file"])[0], FileURLs(file_id="file"))
+if {mode!r} == "buffer":
+    with open({dst!r}, "wb") as f:
+        f.write(upload.getbuffer())
+else:
+    pipeline.save_upload(upload, {dst!r})
+    manager.remove_file("session", "file")
+    del upload
+gc.collect()
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({{"upload_mb": uploaded - baseline, "save_extra_mb": peak - uploaded,
+                  "retained_mb": rss_mb() - baseline}}))
+"""
+
+
+def measure_upload(size_mb, mode, dst):
+    """RSS процесса при сохранении загрузки size_mb МБ (mode: buffer/stream), в МБ (Linux)"""
+    code = UPLOAD_SCRIPT.format(size_mb=size_mb, mode=mode, dst=dst)
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def bench_upload_memory(size_mb, work_dir):
+    """Память при сохранении большой загрузки: прежний код против save_upload с освобождением"""
+    dst = os.path.join(work_dir, "copy.mp4")
+    results = {"size_mb": size_mb}
+    for mode in ("buffer", "stream"):
+        results[mode] = measure_upload(size_mb, mode, dst)
+        print(f"{mode}: загрузка {results[mode]['upload_mb']:.0f} МБ, при записи +{results[mode]['save_extra_mb']:.0f} МБ, "
+              f"остаётся после записи {results[mode]['retained_mb']:.0f} МБ")
+    return results
+
+
+def write_results(output, data):
+    if output:
+        with open(output, "w") as f:
+            json.dump(data, f, indent=2)
+
+
+@click.group()
+def cli():
+    """Бенчмарки конвейера рендера"""
+
+
+@cli.command()
+@click.option("--profiles", default=",".join(pipeline.ENCODE_PROFILES), show_default=True,
+              help="Профили кодирования через запятую")
+@click.option("--output", type=click.Path(dir_okay=False), help="Сохранить результаты в JSON")
+def profiles(profiles, output):
+    """Сравнить профили кодирования на эталонном наборе клипов"""
+    if not pipeline.check_ffmpeg_available():
+        print("❌ FFmpeg недоступен")
+        sys.exit(1)
+
+    work_dir = tempfile.mkdtemp(prefix="replicator_bench_")
+    try:
+        print("Генерация эталонных клипов: " + ", ".join(f"{s} {d}с" for s, d in REFERENCE_CLIPS))
+        prepare_reference_clips(work_dir)
+        results = bench_profiles(profiles.split(","), work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    write_results(output, {"clips": REFERENCE_CLIPS, "cpu_count": os.cpu_count(), "results": results})
+
+
+@cli.command()
+@click.option("--count", default=4, show_default=True, help="Число вариантов текста")
+@click.option("--profile", default=pipeline.DEFAULT_PROFILE, show_default=True,
+              type=click.Choice(list(pipeline.ENCODE_PROFILES)), help="Профиль кодирования")
+@click.option("--output", type=click.Path(dir_okay=False), help="Сохранить результаты в JSON")
+def variants(count, profile, output):
+    """Сравнить рендер N вариантов текста с N отдельными рендерами"""
+    if not pipeline.check_ffmpeg_available():
+        print("❌ FFmpeg недоступен")
+        sys.exit(1)
+
+    work_dir = tempfile.mkdtemp(prefix="replicator_bench_")
+    try:
+        prepare_reference_clips(work_dir)
+        results = bench_variants(count, work_dir, profile)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    write_results(output, {"clips": REFERENCE_CLIPS, "cpu_count": os.cpu_count(), **results})
+
+
+@cli.command()
+@click.option("--profile", default=pipeline.DEFAULT_PROFILE, show_default=True,
+              type=click.Choice(list(pipeline.ENCODE_PROFILES)), help="Профиль полного рендера")
+@click.option("--output", type=click.Path(dir_okay=False), help="Сохранить результаты в JSON")
+def preview(profile, output):
+    """Время превью (кадр, видео, из кэша) на эталонном наборе против полного рендера"""
+    if not pipeline.check_ffmpeg_available():
+        print("❌ FFmpeg недоступен")
+        sys.exit(1)
+
+    root = tempfile.mkdtemp(prefix="replicator_bench_")
+    # Кэш превью бенчмарка не смешиваем с рабочим
+    work_dir, pipeline.WORK_DIR = pipeline.WORK_DIR, root
+    try:
+        prepare_reference_clips(root)
+        results = bench_preview(root, profile)
+    finally:
+        pipeline.WORK_DIR = work_dir
+        shutil.rmtree(root, ignore_errors=True)
+
+    write_results(output, {"clips": REFERENCE_CLIPS, "cpu_count": os.cpu_count(), **results})
+
+
+@cli.command()
+@click.option("--scenarios", default=",".join(s["name"] for s in SUITE_SCENARIOS), show_default=True,
+              help="Сценарии через запятую")
+@click.option("--profile", default=pipeline.DEFAULT_PROFILE, show_default=True,
+              type=click.Choice(list(pipeline.ENCODE_PROFILES)), help="Профиль кодирования")
+@click.option("--engine", default="parts", show_default=True, type=click.Choice(["parts", "single", "pipe"]))
+@click.option("--repeat", default=1, show_default=True, help="Прогонов каждого сценария")
+@click.option("--output", type=click.Path(dir_okay=False), help="Сохранить результаты в JSON")
+def suite(scenarios, profile, engine, repeat, output):
+    """Набор сценариев на синтетических данных: время, fps, RSS, временные файлы, размер"""
+    if not pipeline.check_ffmpeg_available():
+        print("❌ FFmpeg недоступен")
+        sys.exit(1)
+
+    by_name = {s["name"]: s for s in SUITE_SCENARIOS}
+    unknown = [name for name in scenarios.split(",") if name not in by_name]
+    if unknown:
+        print(f"Неизвестные сценарии: {', '.join(unknown)}")
+        sys.exit(1)
+
+    root = tempfile.mkdtemp(prefix="replicator_bench_")
+    # Кэш и журнал метрик бенчмарка не смешиваем с рабочими
+    work_dir, pipeline.WORK_DIR = pipeline.WORK_DIR, root
+    try:
+        results = bench_suite([by_name[name] for name in scenarios.split(",")], profile, engine, repeat, root)
+    finally:
+        pipeline.WORK_DIR = work_dir
+        shutil.rmtree(root, ignore_errors=True)
+
+    write_results(output, {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "ffmpeg": ffmpeg_version(),
+        "results": results,
+    })
+
+
+@cli.command()
+@click.argument("baseline", type=click.Path(exists=True, dir_okay=False))
+@click.argument("current", type=click.Path(exists=True, dir_okay=False))
+def compare(baseline, current):
+    """Сравнить два результата suite по времени, пиковому RSS и размеру"""
+    def load(path):
+        with open(path) as f:
+            runs = {}
+            for r in json.load(f)["results"]:
+                runs.setdefault(r["scenario"], []).append(r)
+        # при нескольких прогонах берём лучший по времени
+        return {name: min(rs, key=lambda r: r["wall_s"]) for name, rs in runs.items()}
+
+    old, new = load(baseline), load(current)
+    print(f"{'сценарий':26s} {'было, с':>8s} {'стало, с':>8s} {'Δ время':>8s} {'Δ RSS':>7s} {'Δ размер':>8s}")
+    for name in old:
+        if name not in new:
+            continue
+        a, b = old[name], new[name]
+        change = lambda key: f"{(b[key] - a[key]) / a[key] * 100:+.0f}%" if a[key] else "—"
+        print(f"{name:26s} {a['wall_s']:8.2f} {b['wall_s']:8.2f} {change('wall_s'):>8s} "
+              f"{change('peak_rss_mb'):>7s} {change('output_bytes'):>8s}")
+
+
+@cli.command()
+@click.option("--duration", default=120, show_default=True, help="Длительность клипа, с")
+@click.option("--segment", "segment_seconds", default=30, show_default=True, help="Длина сегмента, с")
+@click.option("--workers", default=max(2, os.cpu_count() or 1), show_default=True,
+              help="Параллельных процессов ffmpeg")
+@click.option("--profile", default=pipeline.DEFAULT_PROFILE, show_default=True,
+              type=click.Choice(list(pipeline.ENCODE_PROFILES)), help="Профиль кодирования")
+@click.option("--output", type=click.Path(dir_okay=False), help="Сохранить результаты в JSON")
+def segments(duration, segment_seconds, workers, profile, output):
+    """Рендер длинного клипа сегментами: ускорение и проверка стыков и синхронности звука"""
+    if not pipeline.check_ffmpeg_available():
+        print("❌ FFmpeg недоступен")
+        sys.exit(1)
+
+    work_dir = tempfile.mkdtemp(prefix="replicator_bench_")
+    try:
+        os.makedirs(os.path.join(work_dir, "video"))
+        results = bench_segments(duration, segment_seconds, workers, work_dir, profile)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    write_results(output, {"cpu_count": os.cpu_count(), **results})
+    if not results["ok"]:
+        sys.exit(1)
+
+
+@cli.command()
+@click.option("--repeat", default=5, show_default=True, help="Новых процессов на режим (берётся лучший)")
+@click.option("--reruns", default=10, show_default=True, help="Перезапусков страницы")
+@click.option("--output", type=click.Path(dir_okay=False), help="Сохранить результаты в JSON")
+def startup(repeat, reruns, output):
+    """Холодный запуск (импорт, проверка FFmpeg) и перезапуски страницы Streamlit"""
+    root = tempfile.mkdtemp(prefix="replicator_bench_")
+    try:
+        results = bench_startup(repeat, reruns, root)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    write_results(output, {"python": platform.python_version(), **results})
+
+
+@cli.command("upload-memory")
+@click.option("--size-mb", default=512, show_default=True, help="Размер сгенерированного файла")
+@click.option("--output", type=click.Path(dir_okay=False), help="Сохранить результаты в JSON")
+def upload_memory(size_mb, output):
+    """Пиковый RSS при сохранении большой загрузки"""
+    work_dir = tempfile.mkdtemp(prefix="replicator_bench_")
+    try:
+        results = bench_upload_memory(size_mb, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    write_results(output, results)
+
+
+@cli.command("metrics")
+@click.option("--log", "log_path", type=click.Path(dir_okay=False),
+              help="Журнал метрик (по умолчанию WORK_DIR/metrics.jsonl)")
+@click.option("--output", type=click.Path(dir_okay=False), help="Сохранить сводку в JSON")
+def metrics_summary(log_path, output):
+    """Сводка по этапам рендера из журнала метрик: где уходит время"""
+    log_path = log_path or os.path.join(pipeline.WORK_DIR, metrics.METRICS_FILE)
+    records = metrics.read_metrics(log_path)
+    if not records:
+        print(f"Журнал метрик пуст: {log_path}")
+        sys.exit(1)
+
+    summary = metrics.aggregate_metrics(records)
+    print(f"Задач: {len({r.get('job') for r in records})}, записей: {len(records)}")
+    print(f"{'этап':8s} {'запусков':>8s} {'среднее, с':>11s} {'CPU, с':>8s} {'доля':>6s} {'ошибок':>7s}")
+    for stage, s in sorted(summary.items(), key=lambda item: -item[1]["wall_s"]):
+        print(f"{stage:8s} {s['count']:8d} {s['wall_s_mean']:11.2f} {s['cpu_s_mean']:8.2f} "
+              f"{s['wall_share'] * 100:5.0f}% {s['errors']:7d}")
+
+    write_results(output, summary)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,281 @@
+"""Очередь задач рендера на SQLite и пул рабочих потоков.
+
+Задачи выполняются вне потока Streamlit: UI только ставит задачу в очередь и
+опрашивает её статус, поэтому рендер не теряется при переподключении браузера.
+Ограничение на число одновременных рендеров общее для всех процессов, которые
+работают с одной базой (Streamlit и `python jobs.py worker`).
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+import click
+
+import pipeline
+
+MAX_RUNNING_JOBS = int(os.environ.get("REPLICATOR_MAX_JOBS", 2))  # глобальный лимит рендеров
+POLL_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 10
+STALE_TIMEOUT = 120  # задача «running» без сердцебиения дольше — воркер умер, возвращаем в очередь
+FINISH_RETRIES = 5  # попыток записать итоговый статус задачи (база может быть занята)
+
+# Статусы задачи
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    work_dir TEXT NOT NULL,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    worker TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    heartbeat REAL
+)
+"""
+
+
+def get_db_path():
+    """Путь к базе очереди"""
+    return os.path.join(pipeline.WORK_DIR, "jobs.sqlite3")
+
+
+@contextmanager
+def _db(db_path=None):
+    """Соединение с базой очереди (autocommit, WAL для параллельного доступа)"""
+    db_path = db_path or get_db_path()
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(SCHEMA)
+        yield conn
+    finally:
+        conn.close()
+
+
+def _row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    return job
+
+
+def submit_job(work_dir, params, db_path=None):
+    """Поставить задачу в очередь. params — аргументы process_videos. Возвращает id"""
+    job_id = uuid.uuid4().hex
+    with _db(db_path) as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, status, params, work_dir, message, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, QUEUED, json.dumps(params), work_dir, "В очереди...", time.time()),
+        )
+    return job_id
+
+
+def get_job(job_id, db_path=None):
+    """Задача по id (словарь) или None"""
+    with _db(db_path) as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_job(row)
+
+
+def get_queue_position(job_id, db_path=None):
+    """Сколько задач в очереди перед этой"""
+    with _db(db_path) as conn:
+        row = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ? AND created < (SELECT created FROM jobs WHERE id = ?)",
+            (QUEUED, job_id),
+        ).fetchone()
+    return row[0]
+
+
+def get_active_work_dirs(db_path=None):
+    """Рабочие директории задач в очереди и в работе"""
+    with _db(db_path) as conn:
+        rows = conn.execute("SELECT work_dir FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+    return {row[0] for row in rows}
+
+
+def update_job(job_id, db_path=None, **fields):
+    """Обновить поля задачи и отметить сердцебиение"""
+    fields["heartbeat"] = time.time()
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    with _db(db_path) as conn:
+        conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+
+def try_update_job(job_id, db_path=None, **fields):
+    """update_job, который при ошибке базы только пишет в лог. Возвращает успех"""
+    try:
+        update_job(job_id, db_path, **fields)
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Задача {job_id}: не удалось обновить статус в базе: {e}")
+        return False
+
+
+def requeue_stale(timeout=STALE_TIMEOUT, db_path=None):
+    """Вернуть в очередь задачи, чей воркер перестал подавать признаки жизни"""
+    with _db(db_path) as conn:
+        cur = conn.execute(
+            "UPDATE jobs SET status = ?, worker = NULL, message = ? WHERE status = ? AND heartbeat < ?",
+            (QUEUED, "Перезапуск после сбоя воркера...", RUNNING, time.time() - timeout),
+        )
+    if cur.rowcount:
+        logger.warning(f"Возвращено в очередь зависших задач: {cur.rowcount}")
+    return cur.rowcount
+
+
+def claim_job(worker_id, max_running=MAX_RUNNING_JOBS, db_path=None):
+    """Атомарно взять самую старую задачу из очереди, если не превышен глобальный лимит"""
+    with _db(db_path) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (RUNNING,)).fetchone()[0]
+            row = None
+            if running < max_running:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)
+                ).fetchone()
+            if row is not None:
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker = ?, started = ?, heartbeat = ?, message = ? WHERE id = ?",
+                    (RUNNING, worker_id, now, now, "Запуск...", row["id"]),
+                )
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    return _row_to_job(row)
+
+
+def run_job(job, db_path=None):
+    """Выполнить задачу рендера и записать результат в базу"""
+    job_id = job["id"]
+    stop_heartbeat = threading.Event()
+
+    def heartbeat():
+        # Длинная команда ffmpeg может долго не сообщать прогресс — подаём признаки жизни сами.
+        # Ошибка базы (например, занята дольше таймаута) не должна останавливать сердцебиение:
+        # иначе задачу сочтут зависшей и запустят второй раз
+        while not stop_heartbeat.wait(HEARTBEAT_INTERVAL):
+            try_update_job(job_id, db_path)
+
+    beat = threading.Thread(target=heartbeat, daemon=True)
+    beat.start()
+    try:
+        try:
+            # Сообщение о прогрессе не должно ронять идущий рендер, если база занята
+            final = pipeline.process_videos(
+                progress_callback=lambda m: try_update_job(job_id, db_path, message=m),
+                work_dir=job["work_dir"],
+                **job["params"],
+            )
+            result = dict(status=DONE, result=final, message="✅ Готово!")
+            logger.info(f"Задача {job_id} выполнена: {final}")
+        except Exception as e:
+            logger.error(f"Задача {job_id} завершилась ошибкой: {e}")
+            result = dict(status=FAILED, error=str(e), message="❌ Ошибка")
+        # Итоговый статус повторяем: без него задачу сочтут зависшей и отрендерят заново
+        for attempt in range(FINISH_RETRIES):
+            if try_update_job(job_id, db_path, finished=time.time(), **result):
+                break
+            time.sleep(POLL_INTERVAL * (attempt + 1))
+    finally:
+        stop_heartbeat.set()
+        beat.join()
+
+
+def worker_loop(stop_event, max_running=MAX_RUNNING_JOBS, poll_interval=POLL_INTERVAL, db_path=None):
+    """Брать задачи из очереди и выполнять их, пока не выставлен stop_event"""
+    worker_id = f"{os.getpid()}-{threading.get_ident()}"
+    while not stop_event.is_set():
+        try:
+            requeue_stale(db_path=db_path)
+            job = claim_job(worker_id, max_running, db_path)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка базы очереди: {e}")
+            job = None
+        if job is None:
+            stop_event.wait(poll_interval)
+            continue
+        try:
+            run_job(job, db_path)
+        except Exception as e:
+            # Воркер живёт дальше: иначе очередь в процессе Streamlit остановится насовсем
+            logger.error(f"Воркер {worker_id}: ошибка при выполнении задачи {job['id']}: {e}")
+
+
+def start_workers(count=1, max_running=MAX_RUNNING_JOBS, db_path=None):
+    """Запустить count фоновых воркеров в этом процессе. Возвращает stop_event"""
+    stop_event = threading.Event()
+    for i in range(count):
+        threading.Thread(
+            target=worker_loop, args=(stop_event, max_running, POLL_INTERVAL, db_path),
+            name=f"render-worker-{i}", daemon=True,
+        ).start()
+    return stop_event
+
+
+@click.group()
+def cli():
+    """Очередь задач рендера"""
+
+
+@cli.command()
+@click.option("--workers", default=1, show_default=True, help="Воркеров в этом процессе")
+@click.option("--max-running", default=MAX_RUNNING_JOBS, show_default=True,
+              help="Глобальный лимит одновременных рендеров")
+def worker(workers, max_running):
+    """Запустить воркеры без UI (до Ctrl+C)"""
+    logging.basicConfig(level=logging.INFO)
+    if not pipeline.check_ffmpeg_available():
+        print("❌ FFmpeg недоступен")
+        sys.exit(1)
+
+    stop_event = start_workers(workers, max_running)
+    print(f"Воркеров: {workers}, лимит рендеров: {max_running}, база: {get_db_path()}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop_event.set()
+
+
+@cli.command()
+@click.argument("job_id")
+def status(job_id):
+    """Показать статус задачи"""
+    job = get_job(job_id)
+    if job is None:
+        print(f"Задача {job_id} не найдена")
+        sys.exit(1)
+    print(f"{job['status']}: {job['message'] or ''}")
+    if job["result"]:
+        print(job["result"])
+    if job["error"]:
+        print(job["error"])
+
+
+if __name__ == "__main__":
+    cli()
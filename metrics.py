@@ -0,0 +1,87 @@
+"""Метрики этапов конвейера: время, CPU и размер результата.
+
+Каждый этап рендера (слой, части, склейка, звук) записывается отдельной
+строкой JSON в журнал метрик, чтобы по многим задачам находить узкие места.
+"""
+import os
+import json
+import time
+from contextlib import contextmanager
+
+METRICS_FILE = "metrics.jsonl"
+JOB_STAGE = "job"  # запись задачи целиком; в долю времени этапов не входит
+
+
+def _cpu_time():
+    """CPU процесса и завершённых дочерних процессов (ffmpeg), в секундах"""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+@contextmanager
+def measure_stage(records, stage, outputs=()):
+    """Замерить этап и добавить запись в records.
+
+    Внутри блока можно дописать поля в словарь записи, а ключ "outputs"
+    задать списком файлов, если результаты известны только после этапа.
+    CPU дочерних процессов учитывается для всего процесса, поэтому при
+    нескольких задачах в одном процессе он делится между ними неточно.
+    """
+    record = {"stage": stage, "outputs": list(outputs)}
+    wall_start = time.perf_counter()
+    cpu_start = _cpu_time()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = str(e)[:200]
+        raise
+    finally:
+        record["wall_s"] = round(time.perf_counter() - wall_start, 3)
+        record["cpu_s"] = round(_cpu_time() - cpu_start, 3)
+        outputs = record.pop("outputs")
+        record["output_bytes"] = sum(os.path.getsize(p) for p in outputs if os.path.exists(p))
+        records.append(record)
+
+
+def write_metrics(path, job, records):
+    """Дописать записи этапов задачи в журнал (JSON Lines)"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    now = time.time()
+    with open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps({"job": job, "time": now, **record}, ensure_ascii=False) + "\n")
+
+
+def read_metrics(path):
+    """Прочитать журнал метрик (битые строки пропускаются)"""
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def aggregate_metrics(records):
+    """Сводка по этапам: число запусков, суммарное и среднее время, CPU, доля времени"""
+    summary = {}
+    for r in records:
+        s = summary.setdefault(r["stage"], {"count": 0, "errors": 0, "wall_s": 0.0, "cpu_s": 0.0, "output_bytes": 0})
+        s["count"] += 1
+        s["errors"] += 1 if r.get("error") else 0
+        s["wall_s"] += r.get("wall_s", 0.0)
+        s["cpu_s"] += r.get("cpu_s", 0.0)
+        s["output_bytes"] += r.get("output_bytes", 0)
+
+    total_wall = sum(s["wall_s"] for stage, s in summary.items() if stage != JOB_STAGE) or 1.0
+    for stage, s in summary.items():
+        s["wall_s_mean"] = round(s["wall_s"] / s["count"], 3)
+        s["cpu_s_mean"] = round(s["cpu_s"] / s["count"], 3)
+        s["wall_share"] = round(s["wall_s"] / total_wall, 3) if stage != JOB_STAGE else 1.0
+        s["wall_s"] = round(s["wall_s"], 3)
+        s["cpu_s"] = round(s["cpu_s"], 3)
+    return summary
@@ -0,0 +1,1908 @@
+"""Конвейер рендера видео: FFmpeg, оверлей с текстом, склейка и звук (без Streamlit)"""
+import os
+import sys
+import errno
+import subprocess
+import shutil
+import re
+import time
+import json
+import hashlib
+import logging
+import tempfile
+import queue
+import uuid
+import threading
+import render_cache
+import metrics
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# PIL и imageio_ffmpeg импортируются в функциях, которым они нужны: импорт модуля
+# (запуск приложения, каждый воркер) не платит за них, пока рендер не начался
+
+
+# === КОНСТАНТЫ ===
+WORK_DIR = os.path.abspath("temp_video")
+FRAME_SIZE = (1280, 720)
+# Строки текста: (размер шрифта, y) — заголовок, строка 1, строка 2, дата
+TEXT_LAYOUT = [(68, 150), (42, 250), (42, 300), (36, 400)]
+OVERLAY_FILE = "overlay.png"  # оверлей в корне проекта (прозрачный кадр, если файла нет)
+FFMPEG_TIMEOUT = 300  # 5 минут без прогресса — команда считается зависшей
+STDERR_TAIL = 200  # строк stderr ffmpeg, которые храним для сообщения об ошибке
+PROGRESS_INTERVAL = 1.0  # не чаще раза в секунду обновляем прогресс в UI
+# Звук частей, когда у клипов он разный или есть не у всех (без озвучки)
+PART_AUDIO = {"codec": "aac", "sample_rate": 48000, "channels": 2}
+SEGMENT_SECONDS = 60  # длинные клипы (от двух сегментов) рендерятся параллельно сегментами ~60 с
+SINGLE_PASS_MAX_INPUTS = 64  # больше входов -i — строка команды рискует превысить 32767 символов (Windows)
+SEGMENT_FRAME_TOLERANCE = 0.01  # допуск (в кадрах) на «целое число кадров» до границы сегмента
+# Промежуточные файлы задачи (слой, части, сегменты) — в быстрый каталог (tmpfs), если
+# оценка их объёма помещается в общий бюджет; иначе в work_dir/temp_parts
+SCRATCH_ROOT = os.environ.get("REPLICATOR_SCRATCH_DIR", "/dev/shm")
+SCRATCH_BUDGET = int(os.environ.get("REPLICATOR_SCRATCH_BUDGET", 2 * 1024 ** 3))
+SCRATCH_FACTOR = 2  # оценка пика: части + сегменты или склейка ≈ 2 объёма частей
+SCRATCH_BPP = 0.2  # бит на пиксель кадра частей для оценки их объёма (с запасом для CRF 18–30)
+SCRATCH_AUDIO_BITRATE = 192_000  # бит/с звука частей в оценке
+SCRATCH_STALE = 6 * 3600  # каталоги упавших процессов старше 6 часов удаляются
+SCRATCH_FULL_FREE = 64 * 1024 ** 2  # при меньшем свободном месте SCRATCH_ROOT считается заполненным
+VARIANTS_PER_PASS = 8  # вариантов на одну команду ffmpeg (каждая ветка split — свой кодировщик)
+PIPE_FORMAT = "nut"  # потоковый контейнер частей в режиме "pipe" (пишется в канал без перемотки)
+PIPE_CHUNK = 256 * 1024
+PIPE_BUFFER = 64  # кусков по PIPE_CHUNK (16 МБ) на часть: дальше её ffmpeg ждёт склейку
+PIPE_SUPPORTED = hasattr(os, "mkfifo")  # именованные каналы есть только в POSIX
+UPLOAD_CHUNK = 4 * 1024 * 1024  # запись загрузок кусками по 4 МБ
+TOOLS_FILE = "ffmpeg_tools.json"  # в WORK_DIR: найденные ffmpeg/ffprobe и их версии
+PREVIEW_SCALE = 0.5  # превью в половину кадра (640x360)
+PREVIEW_SECONDS = 3  # длина видео-превью с начала первого клипа
+PREVIEW_AT = 1.0  # секунда первого клипа для кадра-превью
+PREVIEW_MAX_BYTES = 200 * 1024 * 1024  # кэш превью в WORK_DIR/previews
+
+# Профили кодирования libx264: скорость против размера/качества.
+# gop — интервал ключевых кадров; fixed_gop — одинаковая структура GOP во всех
+# частях (без ключевых кадров по смене сцены), чтобы склейка -c copy была корректной.
+ENCODE_PROFILES = {
+    "draft": {"label": "Черновик (ultrafast)", "preset": "ultrafast", "crf": 30, "tune": "zerolatency",
+              "gop": 250, "fixed_gop": False, "threads": 2},
+    "balanced": {"label": "Баланс", "preset": "medium", "crf": 23, "tune": None,
+                 "gop": 50, "fixed_gop": True, "threads": 2},
+    "archive": {"label": "Архив (качество)", "preset": "slow", "crf": 18, "tune": "film",
+                "gop": 250, "fixed_gop": False, "threads": 4},
+}
+DEFAULT_PROFILE = "balanced"
+
+logger = logging.getLogger(__name__)
+
+# Глобальные переменные для путей к FFmpeg
+FFMPEG_PATH = None
+FFPROBE_PATH = None
+_FFMPEG_VERIFIED = False
+_ffmpeg_tools = None  # {"ffmpeg": {...}, "ffprobe": {...}}: путь, версия, (mtime, размер) бинарника
+_ffmpeg_check_lock = threading.Lock()
+
+# Кэш метаданных ffprobe: (путь, размер, mtime) -> словарь probe_media
+_probe_cache = {}
+_probe_lock = threading.Lock()
+
+# Зарезервированное задачами этого процесса место в SCRATCH_ROOT: каталог -> байты
+_scratch_reserved = {}
+_scratch_lock = threading.Lock()
+
+
+def get_base_path():
+    """Получить базовый путь (для работы с bundled приложением)"""
+    if getattr(sys, 'frozen', False):
+        # Запущено из PyInstaller exe
+        return sys._MEIPASS if hasattr(sys, '_MEIPASS') else os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def get_font_path():
+    """Получить путь к шрифту"""
+    base_path = get_base_path()
+    
+    # Сначала проверяем bundled шрифт
+    bundled_fonts = [
+        os.path.join(base_path, "fonts", "DejaVuSans.ttf"),
+        os.path.join(base_path, "fonts", "LiberationSans-Regular.ttf"),
+        os.path.join(base_path, "fonts", "Arial.ttf"),
+    ]
+    
+    for font in bundled_fonts:
+        if os.path.exists(font):
+            return font
+    
+    # Fallback на системные шрифты
+    system_fonts = [
+        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+        "/System/Library/Fonts/Arial.ttf",
+        "C:/Windows/Fonts/arial.ttf",
+        "C:/Windows/Fonts/segoeui.ttf",
+    ]
+    for font in system_fonts:
+        if os.path.exists(font):
+            return font
+    
+    # Если шрифт не найден, возвращаем пустую строку
+    # FFmpeg будет использовать встроенный шрифт или системный по умолчанию
+    return ""
+
+
+def find_ffmpeg():
+    """Пути к ffmpeg и ffprobe: REPLICATOR_FFMPEG / REPLICATOR_FFPROBE, imageio-ffmpeg, PATH.
+    
+    ffprobe ищется сначала рядом с ffmpeg (той же сборки), затем в PATH.
+    """
+    ffmpeg = os.environ.get("REPLICATOR_FFMPEG")
+    if not ffmpeg:
+        try:
+            from imageio_ffmpeg import get_ffmpeg_exe
+            ffmpeg = get_ffmpeg_exe()
+        except Exception as e:
+            logger.warning(f"imageio-ffmpeg не дал FFmpeg, ищем в PATH: {e}")
+            ffmpeg = shutil.which("ffmpeg")
+    
+    ffprobe = os.environ.get("REPLICATOR_FFPROBE")
+    if not ffprobe and ffmpeg:
+        sibling = os.path.join(os.path.dirname(ffmpeg), "ffprobe.exe" if os.name == "nt" else "ffprobe")
+        ffprobe = sibling if os.path.isfile(sibling) else shutil.which("ffprobe")
+    return ffmpeg, ffprobe
+
+
+def init_ffmpeg():
+    """Инициализировать пути к FFmpeg и FFprobe"""
+    global FFMPEG_PATH, FFPROBE_PATH
+    
+    ffmpeg, ffprobe = find_ffmpeg()
+    FFMPEG_PATH = FFMPEG_PATH or ffmpeg
+    FFPROBE_PATH = FFPROBE_PATH or ffprobe
+    if FFMPEG_PATH is None or FFPROBE_PATH is None:
+        logger.error(f"Не найдены бинарники FFmpeg: ffmpeg={FFMPEG_PATH}, ffprobe={FFPROBE_PATH}")
+        return False
+    return True
+
+
+def _binary_stat(path):
+    """(mtime, размер) бинарника: по ним сохранённая запись считается актуальной"""
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def tool_version(path):
+    """Первая строка `path -version` (исключение, если бинарник не запускается)"""
+    result = subprocess.run([path, "-version"], capture_output=True, text=True, timeout=10)
+    if result.returncode != 0:
+        raise Exception(f"{path} -version завершился с кодом {result.returncode}")
+    return (result.stdout.splitlines() or [""])[0]
+
+
+def load_tools_record(path=None):
+    """Сохранённые пути и версии ffmpeg/ffprobe, если бинарники с тех пор не менялись"""
+    path = path or os.path.join(WORK_DIR, TOOLS_FILE)
+    try:
+        with open(path) as f:
+            record = json.load(f)
+        for name in ("ffmpeg", "ffprobe"):
+            if _binary_stat(record[name]["path"]) != record[name]["stat"]:
+                return None
+        return record
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_tools_record(record, path=None):
+    """Сохранить пути и версии ffmpeg/ffprobe для следующих запусков"""
+    path = path or os.path.join(WORK_DIR, TOOLS_FILE)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(record, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить {path}: {e}")
+
+
+def check_ffmpeg_available():
+    """Проверить доступность FFmpeg и FFprobe (один раз за процесс).
+    
+    Найденные пути и версии сохраняются в WORK_DIR/TOOLS_FILE вместе с mtime и
+    размером бинарников: следующий запуск берёт их оттуда без поиска и запуска
+    `-version`, пока бинарники не заменили. Пути, заданные в FFMPEG_PATH /
+    FFPROBE_PATH до проверки или в REPLICATOR_FFMPEG / REPLICATOR_FFPROBE,
+    имеют приоритет: запись принимается, только если её пути с ними совпадают.
+    """
+    global FFMPEG_PATH, FFPROBE_PATH, _FFMPEG_VERIFIED, _ffmpeg_tools
+    
+    if _FFMPEG_VERIFIED:
+        return True
+    
+    with _ffmpeg_check_lock:
+        if _FFMPEG_VERIFIED:
+            return True
+        
+        ffmpeg = FFMPEG_PATH or os.environ.get("REPLICATOR_FFMPEG") or None
+        ffprobe = FFPROBE_PATH or os.environ.get("REPLICATOR_FFPROBE") or None
+        record = load_tools_record()
+        if record and ffmpeg in (None, record["ffmpeg"]["path"]) \
+                and ffprobe in (None, record["ffprobe"]["path"]):
+            FFMPEG_PATH = record["ffmpeg"]["path"]
+            FFPROBE_PATH = record["ffprobe"]["path"]
+            _ffmpeg_tools = record
+            _FFMPEG_VERIFIED = True
+            return True
+        
+        # Если еще не инициализировали
+        if FFMPEG_PATH is None or FFPROBE_PATH is None:
+            if not init_ffmpeg():
+                return False
+        
+        try:
+            record = {
+                name: {"path": path, "version": tool_version(path), "stat": _binary_stat(path)}
+                for name, path in (("ffmpeg", FFMPEG_PATH), ("ffprobe", FFPROBE_PATH))
+            }
+        except (FileNotFoundError, PermissionError):
+            logger.error("FFmpeg не найден. Приложение не может работать.")
+            return False
+        except subprocess.TimeoutExpired:
+            logger.error("Таймаут при проверке FFmpeg/FFprobe.")
+            return False
+        except Exception as e:
+            logger.error(f"Ошибка при проверке FFmpeg: {e}")
+            return False
+        save_tools_record(record)
+        _ffmpeg_tools = record
+        _FFMPEG_VERIFIED = True
+        return True
+
+
+def get_ffmpeg_tools():
+    """Пути и версии ffmpeg/ffprobe после успешной проверки (None, если FFmpeg недоступен)"""
+    return _ffmpeg_tools if check_ffmpeg_available() else None
+
+
+def _parse_rate(rate):
+    """Частота кадров из строки ffprobe вида '30000/1001'"""
+    try:
+        num, _, den = str(rate).partition("/")
+        return float(num) / float(den or 1) if float(den or 1) else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _parse_media_info(data):
+    """Свести JSON ffprobe к нужным конвейеру полям"""
+    fmt = data.get("format", {})
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"
+                  and not s.get("disposition", {}).get("attached_pic")), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    
+    try:
+        duration = float(fmt.get("duration", 0) or 0)
+    except ValueError:
+        duration = 0.0
+    
+    info = {"duration": duration, "format": fmt.get("format_name"), "video": None, "audio": None}
+    if video:
+        sar = video.get("sample_aspect_ratio") or "1:1"
+        info["video"] = {
+            "codec": video.get("codec_name"),
+            "profile": video.get("profile"),
+            "pix_fmt": video.get("pix_fmt"),
+            "width": video.get("width"),
+            "height": video.get("height"),
+            "fps": round(_parse_rate(video.get("avg_frame_rate") or video.get("r_frame_rate")), 3),
+            # 0:1 — SAR не задан, считаем квадратный пиксель
+            "sar": "1:1" if sar in ("0:1", "N/A") else sar,
+        }
+    if audio:
+        info["audio"] = {
+            "codec": audio.get("codec_name"),
+            "sample_rate": int(audio.get("sample_rate") or 0),
+            "channels": audio.get("channels"),
+            "channel_layout": audio.get("channel_layout"),
+        }
+    return info
+
+
+def probe_media(filepath):
+    """Метаданные файла одним вызовом ffprobe (JSON).
+    
+    Результат кэшируется по пути, размеру и mtime, поэтому повторные запросы
+    для неизменившегося файла не запускают ffprobe. None — если файл не читается.
+    """
+    global FFPROBE_PATH
+    try:
+        filepath = os.path.abspath(filepath)
+        st = os.stat(filepath)
+        ident = (filepath, st.st_size, st.st_mtime_ns)
+        with _probe_lock:
+            if ident in _probe_cache:
+                return _probe_cache[ident]
+        
+        if not check_ffmpeg_available():
+            raise Exception("FFmpeg недоступен")
+        
+        result = subprocess.run(
+            [FFPROBE_PATH, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", filepath],
+            capture_output=True, text=True, timeout=30
+        )
+        if result.returncode != 0:
+            logger.error(f"Ошибка ffprobe: {result.stderr}")
+            return None
+        info = _parse_media_info(json.loads(result.stdout or "{}"))
+        
+        with _probe_lock:
+            _probe_cache[ident] = info
+        return info
+    except subprocess.TimeoutExpired:
+        logger.error(f"Таймаут ffprobe: {filepath}")
+        return None
+    except ValueError:
+        logger.error(f"Невозможно разобрать ответ ffprobe: {filepath}")
+        return None
+    except Exception as e:
+        logger.error(f"Ошибка при чтении метаданных {filepath}: {e}")
+        return None
+
+
+def get_duration(filepath):
+    """Получить длительность видео"""
+    info = probe_media(filepath)
+    return info["duration"] if info else 0.0
+
+
+def has_audio(filepath):
+    """Проверить, есть ли в файле аудиодорожка"""
+    info = probe_media(filepath)
+    return bool(info and info["audio"])
+
+
+def is_native_frame(info):
+    """Видео уже 1280x720 с квадратным пикселем — масштабирование не нужно"""
+    video = info and info["video"]
+    return bool(video and (video["width"], video["height"]) == FRAME_SIZE and video["sar"] == "1:1")
+
+
+def scale_filter(index, info, label, fps=None):
+    """Фильтр приведения входа index к 1280x720 и частоте fps (лишние шаги пропускаются)"""
+    filters = []
+    if not is_native_frame(info):
+        filters.append(f"scale={FRAME_SIZE[0]}:{FRAME_SIZE[1]},setsar=1")
+    if fps and (info is None or info["video"] is None or info["video"]["fps"] != fps):
+        filters.append(f"fps={fps}")
+    return f"[{index}:v]{','.join(filters) or 'null'}[{label}];"
+
+
+def target_fps(infos):
+    """Общая частота кадров частей: самая частая среди клипов (при равенстве — более ранняя)"""
+    rates = [info["video"]["fps"] for info in infos if info and info["video"] and info["video"]["fps"]]
+    return Counter(rates).most_common(1)[0][0] if rates else 25.0
+
+
+def part_audio_mode(infos, with_voice):
+    """Звук частей: "none" — его заменит озвучка, "copy" — у всех клипов одинаковый,
+    "normalize" — привести к PART_AUDIO (клипам без звука — тишина)"""
+    if with_voice:
+        return "none"
+    if all(info and info["audio"] for info in infos):
+        if len({concat_signature(info)[-1] for info in infos}) == 1:
+            return "copy"
+    return "normalize"
+
+
+def part_audio_args(info, mode, silence_index, source_index=0):
+    """Звук части: (дополнительные входы, аргументы выхода).
+    
+    source_index — номер входа с клипом, silence_index — номер входа тишины.
+    """
+    if mode == "none":
+        return [], ["-an"]
+    if mode == "copy":
+        return [], ["-map", f"{source_index}:a:0", "-c:a", "copy"]
+    encode = ["-c:a", PART_AUDIO["codec"], "-ar", str(PART_AUDIO["sample_rate"]),
+              "-ac", str(PART_AUDIO["channels"])]
+    if info["audio"]:
+        return [], ["-map", f"{source_index}:a:0", *encode]
+    silence = [
+        "-f", "lavfi", "-t", f"{info['duration']:.3f}",
+        "-i", f"anullsrc=r={PART_AUDIO['sample_rate']}:cl={'stereo' if PART_AUDIO['channels'] == 2 else 'mono'}",
+    ]
+    return silence, ["-map", f"{silence_index}:a", *encode]
+
+
+def can_passthrough(infos, fps, audio_mode):
+    """Клипы уже в формате частей (H.264 yuv420p 1280x720, общая частота и параметры) —
+    их можно склеить как есть, если накладывать нечего"""
+    if audio_mode == "normalize":
+        return False
+    for info in infos:
+        video = info and info["video"]
+        if not (video and video["codec"] == "h264" and video["pix_fmt"] == "yuv420p"
+                and is_native_frame(info) and video["fps"] == fps):
+            return False
+    return len({concat_signature(info, audio_mode == "copy") for info in infos}) == 1
+
+
+def concat_signature(info, with_audio=True):
+    """Параметры потоков, которые должны совпадать у частей для склейки -c copy"""
+    video = info["video"] or {}
+    sig = tuple(video.get(k) for k in ("codec", "profile", "pix_fmt", "width", "height", "fps", "sar"))
+    if with_audio:
+        audio = info["audio"]
+        sig += (tuple(audio.get(k) for k in ("codec", "sample_rate", "channels")) if audio else None,)
+    return sig
+
+
+def check_concat_copy(parts, with_audio=True):
+    """Можно ли склеить части concat-демуксером с -c copy (по метаданным)"""
+    infos = [probe_media(p) for p in parts]
+    if any(info is None or info["video"] is None for info in infos):
+        return False
+    signatures = {concat_signature(info, with_audio) for info in infos}
+    if len(signatures) > 1:
+        logger.warning(f"Части различаются параметрами потоков, склейка с перекодированием: {signatures}")
+        return False
+    return True
+
+
+def _parse_progress(block, duration, started):
+    """Свести блок -progress ffmpeg к прогрессу: доля, время, скорость, ETA"""
+    def num(key):
+        try:
+            return float(block.get(key, ""))
+        except ValueError:
+            return 0.0
+    
+    # out_time_ms у ffmpeg тоже в микросекундах
+    out_time = max(0.0, (num("out_time_us") or num("out_time_ms")) / 1e6)
+    elapsed = time.monotonic() - started
+    fraction = min(1.0, out_time / duration) if duration else 0.0
+    if block.get("progress") == "end":
+        fraction = 1.0
+    eta = None
+    if 0 < fraction < 1 and elapsed > 0:
+        eta = elapsed * (1 - fraction) / fraction
+    speed = block.get("speed", "").strip().rstrip("x")
+    try:
+        speed = float(speed)
+    except ValueError:
+        speed = out_time / elapsed if elapsed > 0 else 0.0
+    return {"fraction": fraction, "out_time": out_time, "frame": int(num("frame")),
+            "speed": speed, "elapsed": elapsed, "eta": eta}
+
+
+def format_eta(seconds):
+    """Оставшееся время в виде 1:05 или 1:02:05"""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
+
+def format_progress(title, fraction, eta=None, speed=None):
+    """Строка прогресса для UI: «Обработка: 45% (осталось ~0:32, 2.1x)»"""
+    details = []
+    if eta is not None:
+        details.append(f"осталось ~{format_eta(eta)}")
+    if speed:
+        details.append(f"{speed:.1f}x")
+    suffix = f" ({', '.join(details)})" if details else ""
+    return f"{title}: {fraction * 100:.0f}%{suffix}"
+
+
+def throttle(callback, interval=PROGRESS_INTERVAL):
+    """Обёртка над progress_callback: не чаще раза в interval секунд (force=True — сразу)"""
+    lock = threading.Lock()
+    last = [0.0]
+    
+    def wrapper(message, force=False):
+        with lock:
+            now = time.monotonic()
+            if not force and now - last[0] < interval:
+                return
+            last[0] = now
+        callback(message)
+    return wrapper
+
+
+def stage_progress(progress_callback, title):
+    """on_progress для run_ffmpeg: сообщает долю и ETA одной команды через progress_callback"""
+    report = throttle(progress_callback)
+    return lambda p: report(format_progress(title, p["fraction"], p["eta"], p["speed"]))
+
+
+def run_ffmpeg(cmd, cancel_event=None, cwd=None, duration=None, on_progress=None):
+    """Запустить FFmpeg команду в cwd, читая её прогресс по мере кодирования.
+    
+    duration — ожидаемая длительность результата в секундах (для доли и ETA);
+    on_progress получает словарь _parse_progress после каждого блока -progress.
+    Таймаут FFMPEG_TIMEOUT отсчитывается от последнего сообщения о прогрессе,
+    поэтому длинный, но идущий рендер не обрывается. Из stderr хранится только
+    хвост в STDERR_TAIL строк. Прерывается, если выставлен cancel_event.
+    """
+    global FFMPEG_PATH
+    
+    if not check_ffmpeg_available():
+        raise Exception("FFmpeg недоступен")
+    
+    # Заменяем 'ffmpeg' на полный путь
+    cmd = [FFMPEG_PATH if c == "ffmpeg" else c for c in cmd]
+    cmd = [os.path.abspath(c) if os.path.isfile(c) or (isinstance(c, str) and c.endswith(('.mp4', '.mp3', '.png', '.txt'))) else c for c in cmd]
+    # Машиночитаемый прогресс в stdout вместо строки статистики в stderr
+    cmd = [cmd[0], "-progress", "pipe:1", "-nostats", *cmd[1:]]
+    
+    proc = None
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                cwd=cwd or WORK_DIR, errors="replace")
+        stderr_tail = deque(maxlen=STDERR_TAIL)
+        updates = queue.Queue()
+        
+        def read_progress():
+            block = {}
+            for line in proc.stdout:
+                key, _, value = line.strip().partition("=")
+                block[key] = value
+                if key == "progress":  # последняя строка блока: continue / end
+                    updates.put(block)
+                    block = {}
+            updates.put(None)
+        
+        def read_stderr():
+            for line in proc.stderr:
+                stderr_tail.append(line)
+        
+        readers = [threading.Thread(target=read_progress, daemon=True),
+                   threading.Thread(target=read_stderr, daemon=True)]
+        for t in readers:
+            t.start()
+        
+        started = time.monotonic()
+        deadline = started + FFMPEG_TIMEOUT
+        while True:
+            try:
+                block = updates.get(timeout=0.5)
+            except queue.Empty:
+                block = {}
+            if block is None:
+                break
+            if block:
+                deadline = time.monotonic() + FFMPEG_TIMEOUT
+                if on_progress is not None:
+                    on_progress(_parse_progress(block, duration, started))
+            if cancel_event is not None and cancel_event.is_set():
+                proc.kill()
+                proc.wait()
+                raise Exception("Команда FFmpeg отменена")
+            if time.monotonic() > deadline:
+                proc.kill()
+                proc.wait()
+                logger.error(f"Таймаут выполнения команды FFmpeg: {' '.join(cmd)}")
+                raise Exception("Таймаут выполнения команды FFmpeg")
+        
+        proc.wait()
+        for t in readers:
+            t.join()
+        stderr = "".join(stderr_tail)
+        if proc.returncode != 0:
+            logger.error(f"FFmpeg ошибка: {stderr}")
+            raise Exception(f"FFmpeg error: {stderr}")
+        return subprocess.CompletedProcess(cmd, proc.returncode, "", stderr)
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды FFmpeg: {e}")
+        raise
+    finally:
+        # Ошибка в on_progress, KeyboardInterrupt и т.п. — ffmpeg не должен пережить команду
+        # и писать в каталог, который уже удаляет close_scratch
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+def get_encode_profile(profile):
+    """Профиль кодирования по имени (или сам словарь профиля)"""
+    if isinstance(profile, dict):
+        return profile
+    if profile not in ENCODE_PROFILES:
+        raise Exception(f"Неизвестный профиль кодирования: {profile}")
+    return ENCODE_PROFILES[profile]
+
+
+def video_encode_args(profile=DEFAULT_PROFILE):
+    """Аргументы ffmpeg для кодирования видео по профилю"""
+    p = get_encode_profile(profile)
+    args = ["-c:v", "libx264", "-preset", p["preset"], "-crf", str(p["crf"])]
+    if p.get("tune"):
+        args += ["-tune", p["tune"]]
+    args += ["-g", str(p["gop"])]
+    if p.get("fixed_gop"):
+        args += ["-keyint_min", str(p["gop"]), "-sc_threshold", "0", "-flags", "+cgop"]
+    args += ["-pix_fmt", "yuv420p", "-threads", str(p["threads"])]
+    return args
+
+
+def get_default_workers(profile=DEFAULT_PROFILE):
+    """Число параллельных процессов ffmpeg по умолчанию: ядра / потоки на процесс"""
+    cpus = os.cpu_count() or 1
+    return max(1, cpus // max(1, get_encode_profile(profile)["threads"]))
+
+
+def render_parts(jobs, progress_callback, max_workers=None, cwd=None, durations=None, weights=None):
+    """Отрендерить части параллельно.
+    
+    jobs — список (cmd, out) в порядке склейки. Возвращает пути частей в том же
+    порядке. При ошибке одной части остальные процессы ffmpeg прерываются.
+    durations — длительности частей (до какого out_time идёт команда): общий
+    прогресс взвешивается по ним и сообщается с ETA не чаще раза в
+    PROGRESS_INTERVAL. weights — веса команд, если работа не пропорциональна
+    длительности (команда с несколькими выходами).
+    """
+    if max_workers is None:
+        max_workers = get_default_workers()
+    max_workers = max(1, min(max_workers, len(jobs)))
+    durations = durations or [0.0] * len(jobs)
+    weights = [w if w > 0 else 1.0 for w in (weights or durations)]
+    
+    cancel_event = threading.Event()
+    report = throttle(progress_callback)
+    report(f"Обработка {len(jobs)} видео ({max_workers} параллельно)...", force=True)
+    
+    fractions = [0.0] * len(jobs)
+    speeds = {}
+    lock = threading.Lock()
+    started = time.monotonic()
+    
+    def on_progress(i, p):
+        with lock:
+            fractions[i] = p["fraction"]
+            speeds[i] = p["speed"]
+            total = sum(w * f for w, f in zip(weights, fractions)) / sum(weights)
+            done = sum(1 for f in fractions if f >= 1)
+            speed = sum(speeds.values())
+        elapsed = time.monotonic() - started
+        eta = elapsed * (1 - total) / total if 0 < total < 1 else None
+        report(format_progress(f"Обработка {done}/{len(jobs)}", total, eta, speed))
+    
+    def render(i, cmd):
+        run_ffmpeg(cmd, cancel_event, cwd, durations[i] or None, lambda p: on_progress(i, p))
+        with lock:
+            speeds.pop(i, None)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(render, i, cmd): i for i, (cmd, _) in enumerate(jobs)}
+        pending = set(futures)
+        done = 0
+        try:
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    fut.result()  # пробрасываем ошибку рабочего потока
+                    done += 1
+                    report(f"Обработка {done}/{len(jobs)}: видео {futures[fut]+1} готово", force=True)
+        except BaseException:
+            # Останавливаем остальные рендеры: ожидающие отменяем, запущенные прерываем
+            cancel_event.set()
+            for fut in pending:
+                fut.cancel()
+            raise
+    
+    return [out for _, out in jobs]
+
+
+def load_overlay():
+    """Оверлей из корня проекта в размере кадра (прозрачный, если файла нет)"""
+    from PIL import Image
+    
+    if os.path.exists(OVERLAY_FILE):
+        # Читаем прямо из корня проекта — копия в рабочую директорию не нужна
+        with Image.open(OVERLAY_FILE) as src:
+            return src.convert("RGBA").resize(FRAME_SIZE)
+    return Image.new("RGBA", FRAME_SIZE, (0, 0, 0, 0))
+
+
+def _dir_size(path):
+    """Размер файлов каталога в байтах (0, если каталога нет)"""
+    total = 0
+    for dirpath, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def estimate_scratch(infos, fps, copies=SCRATCH_FACTOR):
+    """Оценка пика промежуточных файлов в байтах: copies объёмов частей.
+    
+    Части кодируются в FRAME_SIZE с частотой fps, поэтому их объём считается от
+    выходного разрешения и битрейта (SCRATCH_BPP), а не от размера исходников.
+    """
+    width, height = FRAME_SIZE
+    bitrate = width * height * fps * SCRATCH_BPP + SCRATCH_AUDIO_BITRATE
+    duration = sum(info["duration"] for info in infos if info)
+    return int(copies * duration * bitrate / 8)
+
+
+def open_scratch(scratch, work_dir, estimate):
+    """Выбрать каталог промежуточных файлов задачи и записать его в словарь scratch.
+    
+    SCRATCH_ROOT используется, если estimate байт помещается в SCRATCH_BUDGET
+    вместе с другими задачами (этого процесса — по резерву, других — по факту)
+    и в свободное место; иначе work_dir/temp_parts. scratch["links"] — каталог
+    на одном диске с кэшем рендера для жёстких ссылок на его записи.
+    """
+    root = os.path.join(SCRATCH_ROOT, "replicator") if SCRATCH_ROOT else None
+    fallback = os.path.join(work_dir, "temp_parts")
+    path = None
+    with _scratch_lock:
+        if root and os.path.isdir(SCRATCH_ROOT):
+            used = sum(_scratch_reserved.values())
+            if os.path.isdir(root):
+                for name in os.listdir(root):
+                    other = os.path.join(root, name)
+                    if other in _scratch_reserved:
+                        continue
+                    # Каталог могут удалить другие процессы, пока мы его проверяем
+                    try:
+                        if time.time() - os.path.getmtime(other) > SCRATCH_STALE:
+                            shutil.rmtree(other, ignore_errors=True)
+                        else:
+                            used += _dir_size(other)
+                    except OSError:
+                        continue
+            try:
+                free = shutil.disk_usage(SCRATCH_ROOT).free
+            except OSError:
+                free = 0
+            if used + estimate <= SCRATCH_BUDGET and estimate < free:
+                path = os.path.join(root, uuid.uuid4().hex)
+                _scratch_reserved[path] = estimate
+    
+    scratch.update(dir=path or fallback, location="scratch" if path else "disk", estimate=estimate)
+    os.makedirs(scratch["dir"], exist_ok=True)
+    cache_dir = os.path.join(WORK_DIR, "cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    # Жёсткая ссылка на запись кэша возможна только в пределах одной файловой системы
+    same_device = os.stat(scratch["dir"]).st_dev == os.stat(cache_dir).st_dev
+    scratch["links"] = scratch["dir"] if same_device else fallback
+    os.makedirs(scratch["links"], exist_ok=True)
+    return scratch
+
+
+def note_scratch(scratch):
+    """Учесть текущий объём промежуточных файлов в пике scratch["peak"].
+    
+    Каталог жёстких ссылок на кэш не считается — ссылки не занимают места.
+    """
+    if scratch and scratch.get("dir"):
+        scratch["peak"] = max(scratch.get("peak", 0), _dir_size(scratch["dir"]))
+
+
+def is_no_space(e):
+    """Ошибка нехватки места: OSError ENOSPC или ffmpeg с «No space left on device»"""
+    return (isinstance(e, OSError) and e.errno == errno.ENOSPC) or "No space left on device" in str(e)
+
+
+def scratch_out_of_space(scratch, e):
+    """Нехватка места именно в каталоге промежуточных файлов, а не на диске work_dir.
+    
+    У OSError путь известен; у ffmpeg его в сообщении может не быть — тогда
+    смотрим, действительно ли заполнен SCRATCH_ROOT.
+    """
+    if scratch.get("location") != "scratch" or not is_no_space(e):
+        return False
+    inside = lambda p: os.path.abspath(p).startswith(scratch["dir"] + os.sep)
+    names = [p for p in (getattr(e, "filename", None), getattr(e, "filename2", None)) if isinstance(p, str)]
+    if names:
+        return any(inside(p) for p in names)
+    if scratch["dir"] in str(e):
+        return True
+    try:
+        return shutil.disk_usage(scratch["dir"]).free < SCRATCH_FULL_FREE
+    except OSError:
+        return False
+
+
+def move_scratch_to_disk(scratch, work_dir):
+    """Перенести промежуточные файлы задачи из SCRATCH_ROOT в work_dir/temp_parts.
+    
+    Резерв в SCRATCH_ROOT освобождается; старый каталог запоминается в
+    scratch["moved_from"], чтобы пересчитать пути (scratch_path).
+    """
+    old = scratch["dir"]
+    new = os.path.join(work_dir, "temp_parts")
+    os.makedirs(new, exist_ok=True)
+    for name in os.listdir(old):
+        shutil.move(os.path.join(old, name), os.path.join(new, name))
+    shutil.rmtree(old, ignore_errors=True)
+    with _scratch_lock:
+        _scratch_reserved.pop(old, None)
+    if scratch.get("links") == old:
+        scratch["links"] = new
+    scratch.update(dir=new, location="disk", moved_from=old)
+    return scratch
+
+
+def scratch_path(scratch, path):
+    """Путь (или список путей) с учётом переноса промежуточных файлов на диск"""
+    if isinstance(path, list):
+        return [scratch_path(scratch, p) for p in path]
+    old = scratch.get("moved_from")
+    if not old or not path:
+        return path
+    if path == old:
+        return scratch["dir"]
+    if path.startswith(old + os.sep):
+        return os.path.join(scratch["dir"], os.path.relpath(path, old))
+    return path
+
+
+def retry_on_disk(scratch, work_dir, stage, *paths):
+    """Выполнить этап stage(*paths); если в SCRATCH_ROOT кончилось место —
+    перенести промежуточные файлы в work_dir/temp_parts и повторить этап там.
+    
+    paths — пути (или списки путей) в каталоге промежуточных файлов, которые
+    нужны этапу; при повторе он получает их новые значения.
+    """
+    try:
+        return stage(*(scratch_path(scratch, p) for p in paths))
+    except Exception as e:
+        # ENOSPC при записи итогового файла в work_dir переносом не лечится
+        if not scratch_out_of_space(scratch, e):
+            raise
+        logger.warning(f"Промежуточные файлы: в {SCRATCH_ROOT} закончилось место, этап повторяется на диске")
+        move_scratch_to_disk(scratch, work_dir)
+        return stage(*(scratch_path(scratch, p) for p in paths))
+
+
+def close_scratch(scratch):
+    """Удалить промежуточные файлы задачи и освободить резерв"""
+    for key in ("dir", "links"):
+        if scratch.get(key):
+            shutil.rmtree(scratch[key], ignore_errors=True)
+    with _scratch_lock:
+        _scratch_reserved.pop(scratch.get("dir"), None)
+
+
+def save_upload(src, path, chunk_size=UPLOAD_CHUNK):
+    """Записать загруженный файл на диск кусками, не копируя его целиком в память.
+    
+    Пишем во временный файл и переименовываем, чтобы ffmpeg не увидел недописанный файл.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.part"
+    if hasattr(src, "seek"):
+        src.seek(0)
+    with open(tmp, "wb") as f:
+        shutil.copyfileobj(src, f, chunk_size)
+    os.replace(tmp, path)
+    return path
+
+
+def clean_video_dir(work_dir):
+    """Очистить директорию с видео"""
+    video_dir = os.path.join(work_dir, "video")
+    if os.path.exists(video_dir):
+        for f in os.listdir(video_dir):
+            try:
+                os.remove(os.path.join(video_dir, f))
+            except:
+                pass
+
+
+def find_videos(work_dir):
+    """Найти все source*.mp4 файлы"""
+    video_dir = os.path.join(work_dir, "video")
+    os.makedirs(video_dir, exist_ok=True)
+    
+    files = []
+    if os.path.exists(video_dir):
+        files = [os.path.join(video_dir, f) for f in os.listdir(video_dir) if f.startswith("source") and f.endswith(".mp4")]
+    
+    files.sort(key=lambda x: int(re.findall(r'\d+', os.path.basename(x))[0]) if re.findall(r'\d+', os.path.basename(x)) else 0)
+    return files
+
+
+def next_video_path(work_dir):
+    """Путь для следующего загруженного клипа: номер после уже сохранённых source*.mp4"""
+    numbers = [int(n[0]) for n in (re.findall(r'\d+', os.path.basename(f)) for f in find_videos(work_dir)) if n]
+    return os.path.join(work_dir, "video", f"source{max(numbers, default=0) + 1}.mp4")
+
+
+def load_font(font, size):
+    """Загрузить шрифт нужного размера (встроенный шрифт Pillow, если файла нет)"""
+    from PIL import ImageFont
+    
+    if font:
+        try:
+            return ImageFont.truetype(font, size)
+        except OSError as e:
+            logger.warning(f"Не удалось загрузить шрифт {font}: {e}")
+    return ImageFont.load_default(size=size)
+
+
+def create_text_layer(heading, name1, name2, datetext, font, work_dir):
+    """Отрисовать оверлей и текст в один PNG 1280x720.
+    
+    Слой рисуется один раз на задачу, а ffmpeg накладывает его статичной
+    картинкой — без масштабирования оверлея и drawtext на каждом кадре.
+    """
+    from PIL import ImageDraw
+    
+    os.makedirs(work_dir, exist_ok=True)
+    layer_path = os.path.join(work_dir, "layer.png")
+    
+    img = load_overlay()
+    draw = ImageDraw.Draw(img)
+    cx = FRAME_SIZE[0] // 2
+    for text, (size, y) in zip((heading, name1, name2, datetext), TEXT_LAYOUT):
+        # anchor "ma": центр по горизонтали, y — линия верхнего выносного элемента, как у drawtext
+        draw.text((cx, y), str(text), font=load_font(font, size), fill="white", anchor="ma")
+    img.save(layer_path)
+    
+    return layer_path
+
+
+def single_pass_timeline(files, audio_path):
+    """План однопроходного рендера: (длительности клипов, длительность озвучки, план).
+    
+    Под озвучку берутся ровно те клипы (по кругу), что её покрывают (plan_timeline);
+    без озвучки или без длительностей каждый клип идёт один раз, а озвучка — 0.
+    """
+    durations = [get_duration(f) for f in files]
+    a_dur = get_duration(audio_path) if os.path.exists(audio_path) else 0.0
+    if a_dur <= 0 or not all(d > 0 for d in durations):
+        return durations, 0.0, [(i, None) for i in range(len(files))]
+    return durations, a_dur, plan_timeline(durations, a_dur)
+
+
+def single_pass_demux(infos, use_voice):
+    """Повторы клипов под озвучку можно подать одним входом concat-демуксера:
+    у всех клипов один формат видео (звук клипов под озвучкой не нужен)"""
+    if not use_voice or not all(info and info["video"] for info in infos):
+        return False
+    return len({concat_signature(info, with_audio=False) for info in infos}) == 1
+
+
+def single_pass_inputs(infos, plan, use_voice):
+    """Число входов-клипов однопроходной команды"""
+    return 1 if single_pass_demux(infos, use_voice) else len(plan)
+
+
+def process_single_pass(files, layer, audio_path, final_out, progress_callback, profile=DEFAULT_PROFILE, work_dir=None):
+    """Однопроходный рендер: склейка, оверлей, текст, зацикливание и звук одной командой ffmpeg.
+    
+    Промежуточные temp_parts / medium.mp4 / silent.mp4 не создаются. Клипы одного
+    формата под озвучку идут одним входом concat-демуксера (список — рядом со
+    слоем), иначе каждый кусок плана — отдельный вход (не больше
+    SINGLE_PASS_MAX_INPUTS, см. _process_videos).
+    """
+    progress_callback("Анализ длительности...")
+    durations, a_dur, plan = single_pass_timeline(files, audio_path)
+    use_voice = a_dur > 0
+    if os.path.exists(audio_path) and not use_voice:
+        logger.warning("Не удалось получить длительность аудио или видео файла")
+    infos = [probe_media(f) for f in files]
+    
+    # Без озвучки сохраняем звук клипов, если он есть у всех (иначе concat невозможен)
+    clip_audio = not use_voice and all(has_audio(f) for f in files)
+    
+    cmd = ["ffmpeg", "-y"]
+    if single_pass_demux(infos, use_voice):
+        # Хвост последнего клипа обрезает outpoint в списке
+        list_txt = write_concat_list(os.path.join(os.path.dirname(layer), "single_list.txt"), files, plan)
+        cmd += ["-f", "concat", "-safe", "0", "-i", os.path.abspath(list_txt)]
+        n = 1
+        clips = scale_filter(0, infos[0], "cat")
+    else:
+        sequence = [os.path.abspath(files[i]) for i, _ in plan]
+        n = len(sequence)
+        for f, (_, outpoint) in zip(sequence, plan):
+            if outpoint is not None:
+                cmd += ["-t", f"{outpoint:.3f}"]
+            cmd += ["-i", f]
+        scales = "".join(scale_filter(i, probe_media(f), f"v{i}") for i, f in enumerate(sequence))
+        concat_in = "".join(f"[v{i}]" + (f"[{i}:a]" if clip_audio else "") for i in range(n))
+        concat_out = "[cat][acat]" if clip_audio else "[cat]"
+        clips = f"{scales}{concat_in}concat=n={n}:v=1:a={1 if clip_audio else 0}{concat_out};"
+    cmd += ["-i", os.path.abspath(layer)]
+    if use_voice:
+        cmd += ["-i", os.path.abspath(audio_path)]
+    
+    filter_str = (
+        f"{clips}"
+        f"[{n}:v]setsar=1[ovr];"
+        f"[cat][ovr]overlay=0:0[out]"
+    )
+    cmd += ["-filter_complex", filter_str, "-map", "[out]", *video_encode_args(profile)]
+    if use_voice:
+        cmd += ["-map", f"{n+1}:a", "-c:a", "aac", "-shortest"]
+    elif clip_audio:
+        cmd += ["-map", "[acat]", "-c:a", "aac"]
+    cmd.append(os.path.abspath(final_out))
+    
+    progress_callback(f"Однопроходный рендер {len(files)} видео...")
+    total = a_dur if use_voice else sum(durations)
+    run_ffmpeg(cmd, cwd=work_dir, duration=total,
+               on_progress=stage_progress(progress_callback, f"Однопроходный рендер {len(files)} видео"))
+    return final_out
+
+
+def _open_fifo(path, abort):
+    """Открыть FIFO на запись, как только его откроет читатель; None, если выставлен abort"""
+    while not abort.is_set():
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno != errno.ENXIO:  # ENXIO — читателя ещё нет
+                raise
+            time.sleep(0.05)
+            continue
+        os.set_blocking(fd, True)
+        return fd
+    return None
+
+
+def stream_part(cmd, fifo, abort, cwd=None, tee=None):
+    """Запустить ffmpeg части (вывод в stdout) и перекачивать его вывод в FIFO склейки.
+    
+    Вывод копится в очереди не больше PIPE_BUFFER кусков: пока склейка не дошла
+    до части или читает медленнее, очередь заполняется, поток перестаёт читать
+    stdout и ffmpeg ждёт на записи (backpressure). Если склейка закрыла канал
+    (-shortest) или выставлен abort, процесс убивается без ошибки; ошибкой
+    считается только ненулевой код ffmpeg, завершившегося самостоятельно.
+    tee — файл, куда дополнительно пишется вывод. Возвращает True, если вывод
+    передан целиком.
+    """
+    if not check_ffmpeg_available():
+        raise Exception("FFmpeg недоступен")
+    if abort.is_set():
+        return False
+    
+    cmd = [FFMPEG_PATH if c == "ffmpeg" else c for c in cmd]
+    proc = subprocess.Popen([cmd[0], "-nostats", *cmd[1:]], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, cwd=cwd or WORK_DIR)
+    stderr_tail = deque(maxlen=STDERR_TAIL)
+    chunks = queue.Queue(PIPE_BUFFER)
+    
+    def put(chunk):
+        while not abort.is_set():
+            try:
+                chunks.put(chunk, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def read_output():
+        for chunk in iter(lambda: proc.stdout.read1(PIPE_CHUNK), b""):
+            if not put(chunk):
+                return
+        put(None)
+    
+    def read_stderr():
+        for line in proc.stderr:
+            stderr_tail.append(line.decode(errors="replace"))
+    
+    readers = [threading.Thread(target=read_output, daemon=True),
+               threading.Thread(target=read_stderr, daemon=True)]
+    for t in readers:
+        t.start()
+    
+    finished = False
+    tee_file = open(tee, "wb") if tee else None
+    try:
+        fd = _open_fifo(fifo, abort)
+        if fd is None:
+            return False
+        try:
+            while True:
+                try:
+                    chunk = chunks.get(timeout=0.5)
+                except queue.Empty:
+                    if abort.is_set():
+                        return False
+                    continue
+                if chunk is None:
+                    break
+                if tee_file:
+                    tee_file.write(chunk)
+                view = memoryview(chunk)
+                while view:
+                    view = view[os.write(fd, view):]
+            # Конец вывода: проверяем код до закрытия канала, чтобы склейка не пошла дальше с обрывком
+            proc.wait()
+            finished = True
+            if proc.returncode != 0:
+                stderr = "".join(stderr_tail)
+                logger.error(f"FFmpeg ошибка: {stderr}")
+                raise Exception(f"FFmpeg error: {stderr}")
+            return True
+        except BrokenPipeError:
+            return False  # склейка больше не читает: взяла нужное (-shortest) или прервана
+        finally:
+            os.close(fd)
+    finally:
+        if tee_file:
+            tee_file.close()
+        if not finished:
+            proc.kill()
+            proc.wait()
+        for t in readers:
+            t.join()
+
+
+def process_pipelined(files, layer, audio_path, final_out, progress_callback, fps, audio_mode,
+                      profile=DEFAULT_PROFILE, max_workers=None, work_dir=None, temp_dir=None, scratch=None):
+    """Рендер частей прямо в склейку через именованные каналы, без файлов частей.
+    
+    Каждый кусок таймлайна рендерится своим ffmpeg в PIPE_FORMAT и через FIFO
+    читается concat-демуксером склейки, которая пишет результат, пока части ещё
+    рендерятся. Одновременно работают max_workers ближайших по таймлайну частей.
+    Клип, который под озвучку идёт по кругу, рендерится один раз: его вывод
+    сохраняется в temp_dir, а повторы копируются оттуда без перекодирования.
+    При ошибке любой части склейка и остальные части прерываются, а наружу
+    выходит ошибка части; при ошибке склейки прерываются части.
+    """
+    if not PIPE_SUPPORTED:
+        raise Exception("Режим через каналы недоступен на этой платформе")
+    
+    progress_callback("Анализ длительности...")
+    durations = [get_duration(f) for f in files]
+    a_dur = get_duration(audio_path) if os.path.exists(audio_path) else 0.0
+    use_voice = a_dur > 0 and all(d > 0 for d in durations)
+    plan = plan_timeline(durations, a_dur) if use_voice else [(i, None) for i in range(len(files))]
+    repeats = Counter(i for i, _ in plan)
+    
+    encode_args = video_encode_args(profile)
+    streams = []
+    tees = {}  # клип -> (файл с его первым рендером, событие «файл дописан»)
+    for n, (i, outpoint) in enumerate(plan):
+        fifo = os.path.join(temp_dir, f"part_{n:03d}.{PIPE_FORMAT}")
+        os.mkfifo(fifo)
+        # Длительность из канала concat-демуксер не знает: часть обрезается ровно по длительности
+        # из списка, иначе склейка сдвигает следующие части
+        length = outpoint if outpoint is not None else durations[i]
+        stream = {"fifo": fifo, "length": length, "tee": None, "ready": None, "after": None}
+        if i in tees:
+            stream["cmd"] = ["ffmpeg", "-y", "-i", tees[i][0], "-c", "copy"]
+            stream["after"] = tees[i][1]
+        else:
+            stream["cmd"] = part_command(os.path.abspath(files[i]), [os.path.abspath(layer)], ["pipe:1"],
+                                         fps, audio_mode, encode_args)[:-1]
+            if repeats[i] > 1:
+                tees[i] = (os.path.join(temp_dir, f"clip_{i:03d}.{PIPE_FORMAT}"), threading.Event())
+                stream["tee"], stream["ready"] = tees[i]
+        stream["cmd"] += ["-t", f"{length:.3f}", "-f", PIPE_FORMAT, "pipe:1"]
+        streams.append(stream)
+    fifos = [stream["fifo"] for stream in streams]
+    list_txt = write_concat_list(os.path.join(temp_dir, "list.txt"), fifos,
+                                 durations=[stream["length"] for stream in streams])
+    
+    abort = threading.Event()
+    errors = []
+    
+    def feed(stream):
+        try:
+            # Повтор клипа ждёт, пока его первый рендер допишется в файл
+            while stream["after"] is not None and not stream["after"].wait(0.5):
+                if abort.is_set():
+                    return
+            if stream_part(stream["cmd"], stream["fifo"], abort, work_dir, stream["tee"]) and stream["ready"]:
+                stream["ready"].set()
+        except BaseException as e:
+            errors.append(e)
+            abort.set()  # прерывает и склейку: run_ffmpeg видит abort как отмену
+    
+    max_workers = max(1, min(max_workers or get_default_workers(profile), len(streams)))
+    title = f"Рендер и склейка {len(plan)} частей через каналы"
+    progress_callback(f"{title} ({max_workers} параллельно)...")
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for stream in streams:
+            pool.submit(feed, stream)
+        try:
+            run_ffmpeg(mux_command(list_txt, audio_path if use_voice else None, final_out), abort, work_dir,
+                       a_dur if use_voice else sum(durations), stage_progress(progress_callback, title))
+        except Exception:
+            if errors:
+                raise errors[0] from None  # причина — упавшая часть, а не отменённая склейка
+            raise
+    finally:
+        # Склейка завершилась (или упала) — части, которые ещё ждут её, больше не нужны
+        abort.set()
+        pool.shutdown(wait=True)
+        note_scratch(scratch)
+        remove_files([*fifos, list_txt, *(path for path, _ in tees.values())])
+    if errors:
+        raise errors[0]
+    return final_out
+
+
+def plan_timeline(durations, target):
+    """Какие части нужны, чтобы покрыть target секунд (части идут по кругу).
+    
+    Возвращает список (индекс части, outpoint) — outpoint задан только у последней,
+    обрезаемой части. Вместо зацикливания всей склейки в промежуточный файл берём
+    ровно нужные куски.
+    """
+    n = len(durations)
+    if n == 0 or sum(durations) <= 0:
+        return [(i, None) for i in range(n)]
+    
+    plan = []
+    total = 0.0
+    i = 0
+    while total < target - 0.001:
+        d = durations[i % n]
+        if d > 0:
+            if total + d > target:
+                plan.append((i % n, round(target - total, 3)))
+                total = target
+            else:
+                plan.append((i % n, None))
+                total += d
+        i += 1
+    return plan
+
+
+def write_concat_list(list_txt, parts, plan=None, durations=None):
+    """Список для concat-демуксера; plan — результат plan_timeline.
+    
+    durations — длительности частей для каналов, у которых concat-демуксер не
+    может узнать длительность сам.
+    """
+    plan = plan if plan is not None else [(i, None) for i in range(len(parts))]
+    with open(list_txt, "w") as f:
+        for n, (i, outpoint) in enumerate(plan):
+            f.write(f"file '{os.path.abspath(parts[i])}'\n")
+            if durations is not None:
+                f.write(f"duration {durations[n]:.3f}\n")
+            if outpoint is not None:
+                f.write(f"outpoint {outpoint:.3f}\n")
+    return list_txt
+
+
+def concat_reencode(parts, out, work_dir, profile=DEFAULT_PROFILE, with_audio=True, on_progress=None):
+    """Склеить части concat-фильтром с перекодированием (если -c copy невозможен)"""
+    keep_audio = with_audio and all(has_audio(p) for p in parts)
+    cmd = ["ffmpeg", "-y"]
+    for part in parts:
+        cmd += ["-i", os.path.abspath(part)]
+    streams = "".join(f"[{i}:v]" + (f"[{i}:a]" if keep_audio else "") for i in range(len(parts)))
+    cmd += [
+        "-filter_complex", f"{streams}concat=n={len(parts)}:v=1:a={1 if keep_audio else 0}",
+        *video_encode_args(profile),
+    ]
+    if keep_audio:
+        cmd += ["-c:a", "aac"]
+    cmd.append(os.path.abspath(out))
+    run_ffmpeg(cmd, cwd=work_dir, duration=sum(get_duration(p) for p in parts), on_progress=on_progress)
+    return out
+
+
+def part_filter(fpath, fps=None):
+    """Фильтр части: кадр 1280x720 с общей частотой кадров и наложение слоя (вход 1)"""
+    return (
+        f"{scale_filter(0, probe_media(fpath), 'bg', fps)}"  # 1280x720, setsar=1 и fps, если ещё не так
+        f"[1:v]setsar=1[ovr];"  # слой уже 1280x720, один кадр
+        f"[bg][ovr]overlay=0:0[v]"
+    )
+
+
+def part_cache_key(fpath, layer, fps, audio_mode, encode_args):
+    """Ключ кэша части: одинаков для process_videos и process_variants"""
+    _, audio_args = part_audio_args(probe_media(fpath), audio_mode, 2)
+    return render_cache.make_key(fpath, part_filter(fpath, fps), layer, [*encode_args, *audio_args])
+
+
+def part_command(fpath, layers, outs, fps, audio_mode, encode_args):
+    """Команда ffmpeg, которая рендерит часть клипа fpath для каждого слоя.
+    
+    При нескольких слоях кадр декодируется и масштабируется один раз, а split
+    раздаёт его в ветки со своим слоем.
+    """
+    info = probe_media(fpath)
+    n = len(layers)
+    cmd = ["ffmpeg", "-y", "-i", fpath]
+    for layer in layers:
+        cmd += ["-i", layer]
+    extra_inputs, audio_args = part_audio_args(info, audio_mode, n + 1)
+    cmd += extra_inputs
+    
+    if n == 1:
+        filter_str = part_filter(fpath, fps)
+        labels = ["[v]"]
+    else:
+        labels = [f"[v{j}]" for j in range(n)]
+        filter_str = (
+            f"{scale_filter(0, info, 'bg', fps)}"
+            f"[bg]split={n}" + "".join(f"[b{j}]" for j in range(n)) + ";"
+            + ";".join(f"[{j+1}:v]setsar=1[o{j}];[b{j}][o{j}]overlay=0:0{labels[j]}" for j in range(n))
+        )
+    cmd += ["-filter_complex", filter_str]
+    for label, out in zip(labels, outs):
+        cmd += ["-map", label, *audio_args, *encode_args, out]
+    return cmd
+
+
+def keyframe_times(filepath):
+    """Время ключевых кадров видео (по пакетам, без декодирования), от начала файла"""
+    if not check_ffmpeg_available():
+        raise Exception("FFmpeg недоступен")
+    try:
+        result = subprocess.run(
+            [FFPROBE_PATH, "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", os.path.abspath(filepath)],
+            capture_output=True, text=True, timeout=FFMPEG_TIMEOUT
+        )
+    except subprocess.TimeoutExpired:
+        logger.error(f"Таймаут ffprobe: {filepath}")
+        return []
+    times = []
+    for line in result.stdout.splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" in flags:
+            try:
+                times.append(float(pts))
+            except ValueError:
+                continue
+    times.sort()
+    return [t - times[0] for t in times] if times else []
+
+
+def plan_segments(keyframes, duration, segment_seconds=SEGMENT_SECONDS, fps=None):
+    """Границы сегментов (start, end) по ключевым кадрам; end последнего — None.
+    
+    Сегмент начинается на ключевом кадре не раньше чем через segment_seconds
+    после предыдущего; короткий хвост (меньше половины сегмента) не отделяется.
+    fps — частота, к которой фильтр fps= приводит клип: тогда граница берётся
+    только там, где до неё целое число выходных кадров, иначе каждый сегмент
+    округляет число кадров сам и склейка расходится со звуком.
+    """
+    bounds = [0.0]
+    for t in keyframes:
+        if fps and abs(t * fps - round(t * fps)) > SEGMENT_FRAME_TOLERANCE:
+            continue
+        if t - bounds[-1] >= segment_seconds and duration - t >= segment_seconds / 2:
+            bounds.append(t)
+    return list(zip(bounds, [*bounds[1:], None]))
+
+
+def segment_commands(fpath, layer, fps, encode_args, seg_dir, segment_seconds=SEGMENT_SECONDS):
+    """Команды рендера сегментов длинного клипа: [(cmd, out, длительность)] или [] для короткого.
+    
+    Сегменты начинаются на ключевых кадрах исходника, поэтому -ss перед -i даёт
+    точный первый кадр, а кадры не теряются и не дублируются на стыках (при смене
+    частоты кадров — только на границах с целым числом выходных кадров). Звук в
+    сегменты не пишется — его добавляет join_segments одним куском.
+    """
+    duration = get_duration(fpath)
+    if not segment_seconds or duration < 2 * segment_seconds:
+        return []
+    info = probe_media(fpath)
+    converted = fps and (info is None or info["video"] is None or info["video"]["fps"] != fps)
+    segments = plan_segments(keyframe_times(fpath), duration, segment_seconds, fps if converted else None)
+    if len(segments) < 2:
+        return []
+    
+    os.makedirs(seg_dir, exist_ok=True)
+    commands = []
+    for n, (start, end) in enumerate(segments):
+        out = os.path.join(seg_dir, f"seg_{n:04d}.mp4")
+        cmd = ["ffmpeg", "-y", "-ss", f"{start:.6f}"]
+        if end is not None:
+            cmd += ["-t", f"{end - start:.6f}"]
+        cmd += ["-i", fpath, "-i", layer, "-filter_complex", part_filter(fpath, fps),
+                "-map", "[v]", "-an", *encode_args, out]
+        commands.append((cmd, out, (end if end is not None else duration) - start))
+    return commands
+
+
+def join_segments(fpath, segments, out, audio_mode, work_dir, scratch=None):
+    """Склеить видео сегментов без перекодирования и добавить звук клипа целиком (сегменты удаляются)"""
+    list_txt = os.path.splitext(out)[0] + "_segments.txt"
+    write_concat_list(list_txt, segments)
+    extra_inputs, audio_args = part_audio_args(probe_media(fpath), audio_mode, 2, source_index=1)
+    run_ffmpeg([
+        "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", os.path.abspath(list_txt), "-i", fpath,
+        *extra_inputs, "-map", "0:v", "-c:v", "copy", *audio_args, out,
+    ], cwd=work_dir)
+    note_scratch(scratch)
+    os.remove(list_txt)
+    for segment in segments:
+        os.remove(segment)
+    return out
+
+
+def layer_is_empty(layer):
+    """Слой полностью прозрачный — накладывать нечего"""
+    from PIL import Image
+    
+    with Image.open(layer) as img:
+        return img.convert("RGBA").getchannel("A").getbbox() is None
+
+
+def find_checked_videos(work_dir, progress_callback):
+    """Видео задачи из work_dir/video; ошибка, если их нет или файл пустой"""
+    # Создаём директории
+    for folder in ["video", "audio"]:
+        os.makedirs(os.path.join(work_dir, folder), exist_ok=True)
+    
+    # Получаем видео файлы
+    files = find_videos(work_dir)
+    if not files:
+        raise Exception("Нет видеофайлов!")
+    
+    progress_callback("Проверка файлов...")
+    # Проверяем, что все видеофайлы существуют и доступны
+    for fpath in files:
+        if not os.path.exists(fpath):
+            raise Exception(f"Файл не найден: {fpath}")
+        # Проверяем, что файл не пустой
+        if os.path.getsize(fpath) == 0:
+            raise Exception(f"Видео файл пустой: {fpath}")
+        info = probe_media(fpath)
+        if info is None or info["video"] is None:
+            raise Exception(f"Не удалось прочитать видео: {os.path.basename(fpath)}")
+    return files
+
+
+def assemble_video(temp_files, audio_path, final_out, work_dir, progress_callback, records,
+                   profile=DEFAULT_PROFILE, list_txt=None, medium=None, scratch=None):
+    """Склеить отрендеренные части и добавить звук одной командой по плану таймлайна.
+    
+    Каждый промежуточный файл удаляется сразу после команды, которая его читает:
+    части — после склейки, medium.mp4 — после добавления звука.
+    """
+    a_dur = get_duration(audio_path) if os.path.exists(audio_path) else 0.0
+    temp_dir = os.path.dirname(os.path.abspath(temp_files[0]))
+    list_txt = list_txt or os.path.join(temp_dir, "list.txt")
+    medium = medium or os.path.join(temp_dir, "medium.mp4")
+    
+    # Звук клипов нужен только без озвучки — иначе его различия склейке не мешают
+    if not check_concat_copy(temp_files, with_audio=not a_dur):
+        progress_callback("Склейка видео с перекодированием...")
+        with metrics.measure_stage(records, "concat", [medium]):
+            concat_reencode(temp_files, medium, work_dir, profile, with_audio=not a_dur,
+                            on_progress=stage_progress(progress_callback, "Склейка видео с перекодированием"))
+        note_scratch(scratch)
+        remove_files(temp_files)
+        temp_files = [medium]
+    
+    durations = [get_duration(tf) for tf in temp_files]
+    if os.path.exists(audio_path) and (a_dur == 0 or not all(durations)):
+        logger.warning("Не удалось получить длительность аудио или видео файла")
+        a_dur = 0.0
+    
+    with metrics.measure_stage(records, "mux", [final_out]):
+        if a_dur:
+            progress_callback("Склейка видео и добавление звука...")
+            write_concat_list(list_txt, temp_files, plan_timeline(durations, a_dur))
+            run_ffmpeg(mux_command(list_txt, audio_path, final_out), cwd=work_dir, duration=a_dur,
+                       on_progress=stage_progress(progress_callback, "Склейка видео и добавление звука"))
+        else:
+            progress_callback("Склейка видео...")
+            write_concat_list(list_txt, temp_files)
+            run_ffmpeg(mux_command(list_txt, None, final_out), cwd=work_dir, duration=sum(durations),
+                       on_progress=stage_progress(progress_callback, "Склейка видео"))
+    note_scratch(scratch)
+    remove_files([*temp_files, list_txt])
+    return final_out
+
+
+def mux_command(list_txt, audio_path, final_out):
+    """Склейка частей из списка concat-демуксера без перекодирования видео;
+    с audio_path — звук озвучки вместо звука частей"""
+    cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", os.path.abspath(list_txt)]
+    if audio_path:
+        cmd += ["-i", os.path.abspath(audio_path), "-map", "0:v", "-map", "1:a", "-c:v", "copy",
+                "-c:a", "aac", "-shortest"]
+    else:
+        cmd += ["-c", "copy"]
+    return [*cmd, os.path.abspath(final_out)]
+
+
+def remove_files(paths):
+    """Удалить промежуточные файлы (уже удалённые пропускаются)"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _write_stage_metrics(work_dir, records):
+    """Дописать записи этапов задачи в журнал WORK_DIR/metrics.jsonl"""
+    if not records:
+        return
+    try:
+        metrics.write_metrics(os.path.join(WORK_DIR, metrics.METRICS_FILE),
+                              os.path.basename(work_dir.rstrip(os.sep)), records)
+    except OSError as e:
+        logger.error(f"Не удалось записать метрики: {e}")
+
+
+def _report_scratch(job, scratch):
+    """Пиковый объём промежуточных файлов задачи — в запись "job" и в лог"""
+    job.update(scratch=scratch.get("location"), peak_scratch_bytes=scratch["peak"])
+    if scratch.get("location"):
+        logger.info(f"Промежуточные файлы ({scratch['location']}): пик "
+                    f"{scratch['peak'] / (1024 * 1024):.1f} МБ при оценке {scratch['estimate'] / (1024 * 1024):.1f} МБ")
+
+
+def process_videos(heading, name1, name2, datetext, progress_callback, max_workers=None, engine="parts",
+                   use_cache=True, cache_max_bytes=render_cache.CACHE_MAX_BYTES, profile=DEFAULT_PROFILE,
+                   work_dir=None, stage_metrics=None, segment_seconds=None):
+    """Основная обработка видео
+    
+    max_workers — число одновременно рендерящихся частей (None — по числу ядер
+    и потокам профиля).
+    profile — имя профиля из ENCODE_PROFILES (или словарь с теми же ключами).
+    work_dir — рабочая директория задачи (video/, audio/, результат); по умолчанию WORK_DIR.
+    engine — "parts" (части → склейка → звук), "single" (одна команда ffmpeg) или
+    "pipe" (части идут в склейку через каналы, без файлов частей и кэша).
+    use_cache — брать неизменившиеся части из общего кэша рендера в WORK_DIR/cache.
+    stage_metrics — список, в который добавляются записи этапов (время, CPU, размер);
+    они же дописываются в журнал WORK_DIR/metrics.jsonl; запись "job" содержит
+    пиковый объём промежуточных файлов (peak_scratch_bytes) и где они лежали.
+    segment_seconds — длина сегментов, на которые режутся длинные клипы для
+    параллельного рендера (None — SEGMENT_SECONDS при нескольких процессах, 0 — не резать).
+    """
+    
+    work_dir = work_dir or WORK_DIR
+    records = stage_metrics if stage_metrics is not None else []
+    scratch = {"peak": 0}
+    try:
+        with metrics.measure_stage(records, metrics.JOB_STAGE) as job:
+            try:
+                return _process_videos(heading, name1, name2, datetext, progress_callback, max_workers, engine,
+                                       use_cache, cache_max_bytes, profile, work_dir, records, segment_seconds,
+                                       scratch)
+            finally:
+                _report_scratch(job, scratch)
+    finally:
+        close_scratch(scratch)
+        _write_stage_metrics(work_dir, records)
+
+
+def _process_videos(heading, name1, name2, datetext, progress_callback, max_workers, engine,
+                    use_cache, cache_max_bytes, profile, work_dir, records, segment_seconds, scratch):
+    """Рендер с замером этапов в records (см. process_videos)"""
+    # Проверяем доступность FFmpeg перед началом обработки
+    if not check_ffmpeg_available():
+        raise Exception("FFmpeg недоступен. Обработка видео невозможна.")
+    
+    files = find_checked_videos(work_dir, progress_callback)
+    infos = [probe_media(f) for f in files]
+    fps = target_fps(infos)
+    audio_path = os.path.join(work_dir, "audio", "voice.mp3")
+    final_out = os.path.join(work_dir, "youtube_ready.mp4")
+    if engine == "single":
+        _, a_dur, plan = single_pass_timeline(files, audio_path)
+        if single_pass_inputs(infos, plan, a_dur > 0) > SINGLE_PASS_MAX_INPUTS:
+            # Вход на каждый кусок не помещается в строку команды — рендерим частями
+            logger.warning(f"Однопроходный рендер: {len(plan)} кусков разного формата, рендер частями")
+            progress_callback("Клипы разного формата и длинная озвучка — рендер частями...")
+            engine = "parts"
+    # Однопроходному режиму нужен только слой, каналам — место под повторяющиеся клипы,
+    # частям — под части и сегменты
+    open_scratch(scratch, work_dir, estimate_scratch(infos, fps, {"single": 0, "pipe": 1}.get(engine, SCRATCH_FACTOR)))
+    font = get_font_path()
+    with metrics.measure_stage(records, "layer") as stage:
+        layer = create_text_layer(heading, name1, name2, datetext, font, scratch["dir"])
+        stage["outputs"] = [layer]
+    
+    if engine == "single":
+        with metrics.measure_stage(records, "single", [final_out]) as stage:
+            stage["clips"] = len(files)
+            process_single_pass(files, layer, audio_path, final_out, progress_callback, profile, work_dir)
+        note_scratch(scratch)
+        return final_out
+    
+    cache_dir = os.path.join(WORK_DIR, "cache")
+    encode_args = video_encode_args(profile)
+    with_voice = os.path.exists(audio_path) and get_duration(audio_path) > 0
+    audio_mode = part_audio_mode(infos, with_voice)
+    # Прозрачный слой, а клипы уже в формате частей — склеиваем их без перекодирования
+    passthrough = layer_is_empty(layer) and can_passthrough(infos, fps, audio_mode)
+    max_workers = max_workers or get_default_workers(profile)
+    
+    if engine == "pipe" and not passthrough:
+        # Части не пишутся на диск, поэтому кэш рендера и сегменты здесь не участвуют
+        with metrics.measure_stage(records, "pipe", [final_out]) as stage:
+            stage.update(clips=len(files))
+            retry_on_disk(scratch, work_dir, lambda layer, temp_dir: process_pipelined(
+                files, layer, audio_path, final_out, progress_callback, fps, audio_mode,
+                profile, max_workers, work_dir, temp_dir, scratch), layer, scratch["dir"])
+        return final_out
+    
+    if segment_seconds is None:
+        segment_seconds = SEGMENT_SECONDS if max_workers > 1 else 0
+    
+    def render_stage(layer):
+        """Части всех клипов в каталоге промежуточных файлов; возвращает их пути по порядку"""
+        temp_dir = scratch["dir"]
+        jobs = []
+        job_durations = []
+        temp_files = []
+        cache_keys = {}
+        segmented = {}  # часть -> (клип, сегменты), собираются после рендера
+        rendered = 0
+        
+        for i, fpath in enumerate(files):
+            fpath = os.path.abspath(fpath)
+            layer_abs = os.path.abspath(layer)
+            
+            if passthrough or use_cache:
+                # Жёсткие ссылки (на исходник или запись кэша) — в каталог на том же диске
+                out = os.path.join(scratch["links"], f"part_{i:03d}.mp4")
+                # Старая часть может быть жёсткой ссылкой на запись кэша — не перезаписываем её
+                if os.path.exists(out):
+                    os.remove(out)
+                if passthrough:
+                    render_cache.link_or_copy(fpath, out)
+                    temp_files.append(out)
+                    continue
+                key = part_cache_key(fpath, layer_abs, fps, audio_mode, encode_args)
+                if render_cache.lookup(cache_dir, key, out):
+                    temp_files.append(out)
+                    continue
+            
+            out = os.path.join(temp_dir, f"part_{i:03d}.mp4")
+            if os.path.exists(out):
+                os.remove(out)
+            temp_files.append(out)
+            if use_cache:
+                cache_keys[out] = key
+            
+            rendered += 1
+            segments = segment_commands(fpath, layer_abs, fps, encode_args,
+                                        os.path.join(temp_dir, f"part_{i:03d}_segments"), segment_seconds)
+            if segments:
+                segmented[out] = (fpath, [seg_out for _, seg_out, _ in segments])
+                jobs += [(cmd, seg_out) for cmd, seg_out, _ in segments]
+                job_durations += [d for _, _, d in segments]
+                continue
+            
+            jobs.append((part_command(fpath, [layer_abs], [out], fps, audio_mode, encode_args), out))
+            job_durations.append(get_duration(fpath))
+        
+        if use_cache and not passthrough:
+            hits = len(files) - rendered
+            logger.info(f"Кэш рендера: попаданий {hits}, промахов {rendered}")
+            progress_callback(f"Из кэша: {hits}/{len(files)} видео")
+        
+        stage.update(clips=len(files), rendered=rendered, segments=len(jobs) - rendered + len(segmented),
+                     passthrough=passthrough, outputs=temp_files)
+        if jobs:
+            render_parts(jobs, progress_callback, max_workers, work_dir, job_durations)
+        note_scratch(scratch)
+        for out, (fpath, segments) in segmented.items():
+            join_segments(fpath, segments, out, audio_mode, work_dir, scratch)
+        remove_files([layer])
+        
+        if use_cache:
+            for out, key in cache_keys.items():
+                render_cache.store(cache_dir, key, out)
+            render_cache.evict(cache_dir, cache_max_bytes)
+        return temp_files
+    
+    # 1. Обработка каждого видео (параллельно, порядок частей сохраняется)
+    with metrics.measure_stage(records, "parts") as stage:
+        temp_files = retry_on_disk(scratch, work_dir, render_stage, layer)
+    
+    # 2. Склейка и звук одной командой по плану таймлайна (части удаляются сразу после неё)
+    retry_on_disk(scratch, work_dir, lambda temp_files: assemble_video(
+        temp_files, audio_path, final_out, work_dir, progress_callback, records, profile, scratch=scratch),
+        temp_files)
+    
+    return final_out
+
+
+def process_variants(variants, progress_callback, max_workers=None, use_cache=True,
+                     cache_max_bytes=render_cache.CACHE_MAX_BYTES, profile=DEFAULT_PROFILE,
+                     work_dir=None, stage_metrics=None):
+    """Несколько вариантов текста на одних и тех же клипах и звуке.
+    
+    variants — список словарей с ключами heading, name1, name2, datetext.
+    Каждый клип декодируется и масштабируется один раз: split раздаёт кадры в
+    ветки со своим слоем, и одна команда ffmpeg пишет части всех вариантов
+    (не больше VARIANTS_PER_PASS за раз). Части попадают в тот же кэш рендера,
+    что и у process_videos. Возвращает пути результатов в порядке variants:
+    work_dir/variant_001.mp4, ...
+    """
+    work_dir = work_dir or WORK_DIR
+    records = stage_metrics if stage_metrics is not None else []
+    scratch = {"peak": 0}
+    try:
+        with metrics.measure_stage(records, metrics.JOB_STAGE) as job:
+            try:
+                return _process_variants(variants, progress_callback, max_workers, use_cache, cache_max_bytes,
+                                         profile, work_dir, records, scratch)
+            finally:
+                _report_scratch(job, scratch)
+    finally:
+        close_scratch(scratch)
+        _write_stage_metrics(work_dir, records)
+
+
+def _process_variants(variants, progress_callback, max_workers, use_cache, cache_max_bytes,
+                      profile, work_dir, records, scratch):
+    """Рендер вариантов с замером этапов в records (см. process_variants)"""
+    if not check_ffmpeg_available():
+        raise Exception("FFmpeg недоступен. Обработка видео невозможна.")
+    if not variants:
+        raise Exception("Нет вариантов текста!")
+    
+    files = find_checked_videos(work_dir, progress_callback)
+    infos = [probe_media(f) for f in files]
+    fps = target_fps(infos)
+    open_scratch(scratch, work_dir, estimate_scratch(infos, fps, SCRATCH_FACTOR * len(variants)))
+    font = get_font_path()
+    audio_path = os.path.join(work_dir, "audio", "voice.mp3")
+    
+    with metrics.measure_stage(records, "layer") as stage:
+        layers = []
+        for k, v in enumerate(variants):
+            variant_dir = os.path.join(scratch["dir"], "variants", f"{k:03d}")
+            layers.append(os.path.abspath(create_text_layer(
+                v["heading"], v["name1"], v["name2"], v["datetext"], font, variant_dir)))
+        stage.update(variants=len(variants), outputs=layers)
+    
+    cache_dir = os.path.join(WORK_DIR, "cache")
+    encode_args = video_encode_args(profile)
+    with_voice = os.path.exists(audio_path) and get_duration(audio_path) > 0
+    audio_mode = part_audio_mode(infos, with_voice)
+    
+    def render_stage(layers):
+        """Части всех вариантов в каталоге промежуточных файлов: parts[вариант][клип]"""
+        temp_dir = scratch["dir"]
+        parts = [[None] * len(files) for _ in variants]
+        jobs = []
+        job_durations = []
+        job_weights = []
+        cache_keys = {}
+        
+        for i, fpath in enumerate(files):
+            fpath = os.path.abspath(fpath)
+            pending = []
+            for k, layer in enumerate(layers):
+                name = f"v{k:03d}_part_{i:03d}.mp4"
+                if use_cache:
+                    key = part_cache_key(fpath, layer, fps, audio_mode, encode_args)
+                    # Жёсткая ссылка на запись кэша — в каталог на том же диске
+                    out = os.path.join(scratch["links"], name)
+                    if os.path.exists(out):
+                        os.remove(out)
+                    if render_cache.lookup(cache_dir, key, out):
+                        parts[k][i] = out
+                        continue
+                out = os.path.join(temp_dir, name)
+                if os.path.exists(out):
+                    os.remove(out)
+                parts[k][i] = out
+                if use_cache:
+                    cache_keys[out] = key
+                pending.append((layer, out))
+            
+            for start in range(0, len(pending), VARIANTS_PER_PASS):
+                batch = pending[start:start + VARIANTS_PER_PASS]
+                cmd = part_command(fpath, [layer for layer, _ in batch], [out for _, out in batch],
+                                   fps, audio_mode, encode_args)
+                jobs.append((cmd, batch[-1][1]))
+                # out_time команды с несколькими выходами идёт до длительности клипа,
+                # а работы в ней — на len(batch) частей
+                job_durations.append(get_duration(fpath))
+                job_weights.append(job_durations[-1] * len(batch))
+        
+        if use_cache:
+            total = len(files) * len(variants)
+            logger.info(f"Кэш рендера: попаданий {total - len(cache_keys)}, промахов {len(cache_keys)}")
+            progress_callback(f"Из кэша: {total - len(cache_keys)}/{total} частей")
+        
+        stage.update(clips=len(files), variants=len(variants), commands=len(jobs),
+                     outputs=[p for variant in parts for p in variant])
+        if jobs:
+            render_parts(jobs, progress_callback, max_workers or get_default_workers(profile), work_dir,
+                         job_durations, job_weights)
+        note_scratch(scratch)
+        shutil.rmtree(os.path.join(temp_dir, "variants"), ignore_errors=True)
+        
+        if use_cache:
+            for out, key in cache_keys.items():
+                render_cache.store(cache_dir, key, out)
+            render_cache.evict(cache_dir, cache_max_bytes)
+        return parts
+    
+    # 1. Части всех вариантов: клип декодируется один раз на VARIANTS_PER_PASS вариантов
+    with metrics.measure_stage(records, "parts") as stage:
+        parts = retry_on_disk(scratch, work_dir, render_stage, layers)
+    
+    # 2. Склейка и звук для каждого варианта (без перекодирования видео)
+    outputs = []
+    for k, variant_parts in enumerate(parts):
+        progress_callback(f"Вариант {k+1}/{len(variants)}: склейка...")
+        final_out = os.path.join(work_dir, f"variant_{k+1:03d}.mp4")
+        retry_on_disk(scratch, work_dir, lambda variant_parts, list_txt, medium: assemble_video(
+            variant_parts, audio_path, final_out, work_dir, lambda m: None, records, profile,
+            list_txt=list_txt, medium=medium, scratch=scratch),
+            variant_parts, os.path.join(scratch["dir"], f"v{k:03d}_list.txt"),
+            os.path.join(scratch["dir"], f"v{k:03d}_medium.mp4"))
+        outputs.append(final_out)
+    
+    return outputs
+
+
+def preview_key(heading, name1, name2, datetext, font, clip, seconds, at, scale):
+    """Ключ кэша превью: тексты, шрифт, оверлей, клип (путь, размер, mtime) и параметры превью"""
+    def ident(path):
+        if not path or not os.path.exists(path):
+            return None
+        st = os.stat(path)
+        return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+    
+    payload = json.dumps([heading, name1, name2, datetext, font, ident(OVERLAY_FILE), ident(clip),
+                          seconds, at, scale, FRAME_SIZE, TEXT_LAYOUT])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def render_preview(heading, name1, name2, datetext, work_dir=None, seconds=0, at=PREVIEW_AT,
+                   scale=PREVIEW_SCALE):
+    """Превью текста на первом клипе в уменьшенном размере.
+    
+    seconds=0 — один кадр на секунде at (JPEG), иначе первые seconds секунд
+    клипа со звуком (MP4). Слой и наложение те же, что у process_videos; кадр
+    уменьшается уже после наложения. Без клипов — слой на чёрном фоне.
+    Результат кэшируется в WORK_DIR/previews по тексту, оверлею, клипу и
+    параметрам, повторное превью того же макета не рендерится.
+    """
+    work_dir = work_dir or WORK_DIR
+    files = find_videos(work_dir)
+    clip = os.path.abspath(files[0]) if files else None
+    font = get_font_path()
+    size = (int(FRAME_SIZE[0] * scale) // 2 * 2, int(FRAME_SIZE[1] * scale) // 2 * 2)
+    video = bool(seconds and clip)
+    
+    preview_dir = os.path.join(WORK_DIR, "previews")
+    key = preview_key(heading, name1, name2, datetext, font, clip, seconds if video else 0, at, scale)
+    out = os.path.join(preview_dir, f"{key}.{'mp4' if video else 'jpg'}")
+    if os.path.exists(out):
+        os.utime(out)  # для вытеснения давно не использованных
+        return out
+    
+    os.makedirs(preview_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix="preview_", dir=preview_dir)
+    try:
+        layer = create_text_layer(heading, name1, name2, datetext, font, temp_dir)
+        tmp_out = os.path.join(temp_dir, os.path.basename(out))
+        if clip is None:
+            from PIL import Image
+            
+            with Image.open(layer) as img:
+                background = Image.new("RGBA", FRAME_SIZE, (0, 0, 0, 255))
+                background.alpha_composite(img.convert("RGBA"))
+                background.convert("RGB").resize(size).save(tmp_out, quality=90)
+        else:
+            filter_str = f"{part_filter(clip)};[v]scale={size[0]}:{size[1]}[p]"
+            if video:
+                cmd = ["ffmpeg", "-y", "-t", f"{seconds:.3f}", "-i", clip, "-i", layer,
+                       "-filter_complex", filter_str, "-map", "[p]", "-map", "0:a?",
+                       "-c:v", "libx264", "-preset", "ultrafast", "-crf", "28", "-pix_fmt", "yuv420p",
+                       "-c:a", "aac", "-movflags", "+faststart", tmp_out]
+            else:
+                duration = get_duration(clip)
+                # Короткий клип: кадр из середины вместо секунды at за его концом
+                start = at if not duration or at < duration else duration / 2
+                cmd = ["ffmpeg", "-y", "-ss", f"{start:.3f}", "-i", clip, "-i", layer,
+                       "-filter_complex", filter_str, "-map", "[p]", "-frames:v", "1", "-q:v", "3", tmp_out]
+            run_ffmpeg(cmd, cwd=work_dir, duration=seconds if video else None)
+        os.replace(tmp_out, out)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    render_cache.evict(preview_dir, PREVIEW_MAX_BYTES, suffixes=(".jpg", ".mp4"))
+    return out
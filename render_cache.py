@@ -0,0 +1,136 @@
+"""Кэш отрендеренных частей видео.
+
+Ключ — хэш содержимого исходника и всех параметров рендера (фильтр, оверлей,
+настройки кодека), поэтому неизменившиеся части переиспользуются без
+перекодирования. Размер кэша ограничен, вытесняются давно не использованные
+записи (LRU по времени последнего обращения).
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+
+CACHE_MAX_BYTES = 5 * 1024 ** 3  # 5 ГБ
+HASH_CHUNK = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# (путь, размер, mtime) -> sha256 содержимого, чтобы не хэшировать файл повторно
+_file_hashes = {}
+# Счётчики за время жизни процесса
+stats = {"hits": 0, "misses": 0}
+
+
+def file_hash(path):
+    """SHA-256 содержимого файла (кэшируется по пути, размеру и mtime)"""
+    st = os.stat(path)
+    ident = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _lock:
+        if ident in _file_hashes:
+            return _file_hashes[ident]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    with _lock:
+        _file_hashes[ident] = digest
+    return digest
+
+
+def make_key(source_path, filter_str, overlay_path, encode_args):
+    """Ключ кэша для части: исходник + фильтр + оверлей + настройки кодирования"""
+    payload = json.dumps([
+        file_hash(source_path),
+        filter_str,
+        file_hash(overlay_path),
+        list(encode_args),
+    ])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], f"{key}.mp4")
+
+
+def link_or_copy(src, dst):
+    """Жёсткая ссылка, а если она невозможна (другой диск) — копия"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def lookup(cache_dir, key, dest):
+    """Достать часть из кэша в dest. Возвращает True при попадании"""
+    entry = _entry_path(cache_dir, key)
+    if not os.path.exists(entry):
+        with _lock:
+            stats["misses"] += 1
+        return False
+
+    try:
+        link_or_copy(entry, dest)
+        os.utime(entry)  # отмечаем обращение для LRU
+    except OSError as e:
+        logger.warning(f"Не удалось взять часть из кэша: {e}")
+        with _lock:
+            stats["misses"] += 1
+        return False
+
+    with _lock:
+        stats["hits"] += 1
+    return True
+
+
+def store(cache_dir, key, src):
+    """Положить отрендеренную часть в кэш"""
+    entry = _entry_path(cache_dir, key)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = f"{entry}.tmp{threading.get_ident()}"
+    try:
+        link_or_copy(src, tmp)
+        os.replace(tmp, entry)
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить часть в кэш: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def evict(cache_dir, max_bytes=CACHE_MAX_BYTES, suffixes=(".mp4",)):
+    """Удалить давно не использованные записи (файлы с расширениями suffixes), пока кэш больше max_bytes"""
+    entries = []
+    total = 0
+    for root, _, names in os.walk(cache_dir):
+        for name in names:
+            if not name.endswith(tuple(suffixes)):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError:
+            pass
+
+    if removed:
+        logger.info(f"Кэш рендера: удалено {removed} записей, размер {total / (1024 * 1024):.1f} МБ")
+    return total
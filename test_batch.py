@@ -0,0 +1,17 @@
+"""Манифест пакетного рендера"""
+import batch
+
+
+def test_csv_missing_trailing_fields_are_empty(tmp_path):
+    """Короткая строка CSV: DictReader даёт None в недостающих колонках — на видео идёт пустая строка"""
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text("clips,audio,heading,name1,name2,date,output\nintro.mp4;main.mp4,,Заголовок\n",
+                        encoding="utf-8")
+
+    row, = batch.read_manifest(str(manifest))
+
+    assert row["clips"] == [str(tmp_path / "intro.mp4"), str(tmp_path / "main.mp4")]
+    assert row["audio"] is None
+    assert row["heading"] == "Заголовок"
+    assert (row["name1"], row["name2"], row["date"]) == ("", "", "")
+    assert row["output"] is None
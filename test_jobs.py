@@ -0,0 +1,110 @@
+"""Очередь задач: глобальный лимит одновременных рендеров и возврат зависших задач"""
+import time
+import sqlite3
+
+import pytest
+
+import jobs
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / "jobs.sqlite3")
+
+
+def submit(db, n):
+    """Поставить n задач; created растёт, чтобы порядок очереди был однозначным"""
+    ids = []
+    for i in range(n):
+        ids.append(jobs.submit_job(f"/work/{i}", {"heading": str(i)}, db))
+        time.sleep(0.002)
+    return ids
+
+
+def test_claim_takes_oldest_queued_job(db):
+    ids = submit(db, 2)
+
+    job = jobs.claim_job("w1", max_running=2, db_path=db)
+    assert job["id"] == ids[0]
+    assert job["status"] == jobs.RUNNING
+    assert job["worker"] == "w1"
+    assert job["params"] == {"heading": "0"}
+    assert jobs.get_job(ids[0], db)["status"] == jobs.RUNNING
+    assert jobs.get_queue_position(ids[1], db) == 0
+
+
+def test_claim_respects_global_limit(db):
+    ids = submit(db, 3)
+
+    assert jobs.claim_job("w1", max_running=2, db_path=db)["id"] == ids[0]
+    assert jobs.claim_job("w2", max_running=2, db_path=db)["id"] == ids[1]
+    # Два рендера уже идут — третий воркер ждёт
+    assert jobs.claim_job("w3", max_running=2, db_path=db) is None
+    assert jobs.get_job(ids[2], db)["status"] == jobs.QUEUED
+
+    jobs.update_job(ids[0], db, status=jobs.DONE)
+    assert jobs.claim_job("w3", max_running=2, db_path=db)["id"] == ids[2]
+
+
+def test_claim_from_empty_queue(db):
+    assert jobs.claim_job("w1", db_path=db) is None
+
+
+def test_requeue_stale_returns_job_without_heartbeat(db):
+    stale, alive = submit(db, 2)
+    jobs.claim_job("w1", max_running=2, db_path=db)
+    jobs.claim_job("w2", max_running=2, db_path=db)
+    with sqlite3.connect(db) as conn:
+        conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time() - 300, stale))
+
+    assert jobs.requeue_stale(timeout=120, db_path=db) == 1
+    job = jobs.get_job(stale, db)
+    assert job["status"] == jobs.QUEUED
+    assert job["worker"] is None
+    assert jobs.get_job(alive, db)["status"] == jobs.RUNNING
+
+    # Возвращённая задача снова берётся первой
+    assert jobs.claim_job("w3", max_running=2, db_path=db)["id"] == stale
+
+
+def test_requeue_stale_ignores_finished_jobs(db):
+    (job_id,) = submit(db, 1)
+    jobs.claim_job("w1", db_path=db)
+    jobs.update_job(job_id, db, status=jobs.DONE)
+    with sqlite3.connect(db) as conn:
+        conn.execute("UPDATE jobs SET heartbeat = 0 WHERE id = ?", (job_id,))
+
+    assert jobs.requeue_stale(timeout=120, db_path=db) == 0
+    assert jobs.get_job(job_id, db)["status"] == jobs.DONE
+
+
+def test_active_work_dirs(db):
+    ids = submit(db, 3)
+    jobs.claim_job("w1", db_path=db)
+    jobs.update_job(ids[2], db, status=jobs.FAILED)
+
+    assert jobs.get_active_work_dirs(db) == {"/work/0", "/work/1"}
+
+
+def test_run_job_survives_database_errors_in_progress(db, monkeypatch):
+    """Ошибка базы при записи прогресса не роняет рендер и не помечает задачу FAILED"""
+    (job_id,) = submit(db, 1)
+    job = jobs.claim_job("w1", db_path=db)
+    real_update = jobs.update_job
+
+    def flaky_update(job_id, db_path=None, **fields):
+        if "message" in fields and "status" not in fields:
+            raise sqlite3.OperationalError("database is locked")
+        real_update(job_id, db_path, **fields)
+
+    def render(progress_callback, **kwargs):
+        progress_callback("Обработка 1/1")
+        return "/work/0/youtube_ready.mp4"
+
+    monkeypatch.setattr(jobs, "update_job", flaky_update)
+    monkeypatch.setattr(jobs.pipeline, "process_videos", render)
+    jobs.run_job(job, db)
+
+    job = jobs.get_job(job_id, db)
+    assert job["status"] == jobs.DONE
+    assert job["result"] == "/work/0/youtube_ready.mp4"
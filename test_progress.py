@@ -0,0 +1,86 @@
+"""Разбор блоков -progress ffmpeg и строка прогресса для UI"""
+import time
+
+import pytest
+
+import pipeline
+from pipeline import _parse_progress, format_eta, format_progress
+
+BLOCK = {
+    "frame": "250", "fps": "50.0", "out_time_us": "10000000", "out_time_ms": "10000000",
+    "out_time": "00:00:10.000000", "speed": "2.5x", "progress": "continue",
+}
+
+
+def test_fraction_speed_and_eta():
+    p = _parse_progress(BLOCK, 40.0, time.monotonic() - 4.0)
+
+    assert p["fraction"] == pytest.approx(0.25)
+    assert p["out_time"] == pytest.approx(10.0)
+    assert p["frame"] == 250
+    assert p["speed"] == pytest.approx(2.5)
+    # 4 с на четверть — ещё ~12 с
+    assert p["eta"] == pytest.approx(12.0, abs=0.5)
+
+
+def test_out_time_ms_is_microseconds_too():
+    """Старые ffmpeg дают только out_time_ms — это тоже микросекунды"""
+    block = {"out_time_ms": "5000000", "progress": "continue"}
+    assert _parse_progress(block, 10.0, time.monotonic())["fraction"] == pytest.approx(0.5)
+
+
+def test_end_block_is_complete():
+    block = dict(BLOCK, progress="end")
+    p = _parse_progress(block, 40.0, time.monotonic() - 1.0)
+    assert p["fraction"] == 1.0
+    assert p["eta"] is None
+
+
+def test_fraction_is_capped_and_unknown_duration_is_zero():
+    assert _parse_progress(BLOCK, 5.0, time.monotonic() - 1.0)["fraction"] == 1.0
+    assert _parse_progress(BLOCK, None, time.monotonic() - 1.0)["fraction"] == 0.0
+
+
+def test_missing_and_invalid_values():
+    """В начале кодирования out_time_us бывает N/A, а speed — N/A"""
+    block = {"frame": "0", "out_time_us": "N/A", "speed": "N/A", "progress": "continue"}
+    p = _parse_progress(block, 10.0, time.monotonic() - 1.0)
+    assert p["fraction"] == 0.0
+    assert p["out_time"] == 0.0
+    assert p["speed"] == 0.0
+    assert p["eta"] is None
+
+
+def test_negative_out_time_is_clamped():
+    block = {"out_time_us": "-23220", "progress": "continue"}
+    assert _parse_progress(block, 10.0, time.monotonic())["out_time"] == 0.0
+
+
+def test_speed_falls_back_to_out_time_over_elapsed():
+    block = {"out_time_us": "6000000", "speed": "N/A", "progress": "continue"}
+    assert _parse_progress(block, 60.0, time.monotonic() - 2.0)["speed"] == pytest.approx(3.0, rel=0.05)
+
+
+def test_format_progress():
+    assert format_eta(65) == "1:05"
+    assert format_eta(3725) == "1:02:05"
+    assert format_progress("Обработка", 0.45, 32, 2.1) == "Обработка: 45% (осталось ~0:32, 2.1x)"
+    assert format_progress("Склейка", 1.0) == "Склейка: 100%"
+
+
+def test_render_parts_weights_multi_output_commands(monkeypatch):
+    """Команда с тремя выходами идёт до длительности клипа, но весит как три части"""
+    def fake_run_ffmpeg(cmd, cancel_event, cwd, duration, on_progress):
+        # out_time команды с несколькими выходами — длительность клипа (10 с)
+        on_progress(_parse_progress({"out_time_us": "10000000", "progress": "continue"}, duration,
+                                    time.monotonic()))
+
+    messages = []
+    monkeypatch.setattr(pipeline, "run_ffmpeg", fake_run_ffmpeg)
+    monkeypatch.setattr(pipeline, "throttle", lambda callback: lambda message, force=False: callback(message))
+    pipeline.render_parts([(["multi"], "a.mp4"), (["single"], "b.mp4")], messages.append, max_workers=1,
+                          durations=[10.0, 10.0], weights=[30.0, 10.0])
+
+    progress = [m for m in messages if "%" in m]
+    assert progress[0].startswith("Обработка 1/2: 75%")
+    assert progress[-1].startswith("Обработка 2/2: 100%")
@@ -0,0 +1,67 @@
+"""Кэш отрендеренных частей: попадания, порядок вытеснения (LRU) и учёт объёма"""
+import os
+
+import render_cache
+
+
+def put(cache_dir, tmp_path, key, size, mtime):
+    """Положить в кэш запись key размером size байт с временем обращения mtime"""
+    src = tmp_path / f"{key}.src"
+    src.write_bytes(b"x" * size)
+    render_cache.store(str(cache_dir), key, str(src))
+    entry = render_cache._entry_path(str(cache_dir), key)
+    os.utime(entry, (mtime, mtime))
+    return entry
+
+
+def test_lookup_hit_and_miss(tmp_path):
+    cache_dir = tmp_path / "cache"
+    put(cache_dir, tmp_path, "aa11", 10, 1000)
+    dest = tmp_path / "part.mp4"
+
+    assert render_cache.lookup(str(cache_dir), "aa11", str(dest))
+    assert dest.read_bytes() == b"x" * 10
+    assert not render_cache.lookup(str(cache_dir), "bb22", str(tmp_path / "other.mp4"))
+
+
+def test_evict_removes_least_recently_used_first(tmp_path):
+    cache_dir = tmp_path / "cache"
+    old = put(cache_dir, tmp_path, "aa11", 100, 1000)
+    middle = put(cache_dir, tmp_path, "bb22", 100, 2000)
+    new = put(cache_dir, tmp_path, "cc33", 100, 3000)
+
+    # Обращение к самой старой записи делает её самой свежей
+    assert render_cache.lookup(str(cache_dir), "aa11", str(tmp_path / "part.mp4"))
+
+    assert render_cache.evict(str(cache_dir), max_bytes=250) == 200
+    assert os.path.exists(old)
+    assert not os.path.exists(middle)
+    assert os.path.exists(new)
+
+
+def test_evict_counts_bytes_and_stops_at_limit(tmp_path):
+    cache_dir = tmp_path / "cache"
+    entries = [put(cache_dir, tmp_path, f"{n:02d}ff", 100 * (n + 1), 1000 + n) for n in range(4)]  # 100..400 байт
+
+    assert render_cache.evict(str(cache_dir), max_bytes=1000) == 1000
+    assert all(os.path.exists(e) for e in entries)
+
+    # 1000 > 750: удаляем 100 и 200 байт (самые старые) — остаётся 700
+    assert render_cache.evict(str(cache_dir), max_bytes=750) == 700
+    assert [os.path.exists(e) for e in entries] == [False, False, True, True]
+
+
+def test_evict_ignores_other_suffixes(tmp_path):
+    """Недописанные .tmp файлы не считаются записями и не удаляются"""
+    cache_dir = tmp_path / "cache"
+    entry = put(cache_dir, tmp_path, "aa11", 100, 1000)
+    tmp = cache_dir / "aa" / "aa11.mp4.tmp1"
+    tmp.write_bytes(b"x" * 1000)
+
+    assert render_cache.evict(str(cache_dir), max_bytes=100) == 100
+    assert os.path.exists(entry)
+    assert tmp.exists()
+
+
+def test_evict_missing_dir(tmp_path):
+    assert render_cache.evict(str(tmp_path / "none"), max_bytes=0) == 0
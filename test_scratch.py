@@ -0,0 +1,63 @@
+"""Промежуточные файлы: перенос на диск только при нехватке места в SCRATCH_ROOT"""
+import errno
+import os
+
+import pytest
+
+import pipeline
+
+
+@pytest.fixture
+def scratch(tmp_path, monkeypatch):
+    """Задача с промежуточными файлами в tmp_path/shm и work_dir в tmp_path/job"""
+    monkeypatch.setattr(pipeline, "WORK_DIR", str(tmp_path))
+    monkeypatch.setattr(pipeline, "SCRATCH_ROOT", str(tmp_path / "shm"))
+    os.makedirs(tmp_path / "shm")
+    work_dir = str(tmp_path / "job")
+    scratch = pipeline.open_scratch({}, work_dir, 1024)
+    assert scratch["location"] == "scratch"
+    yield scratch, work_dir
+    pipeline.close_scratch(scratch)
+
+
+def no_space(path):
+    return OSError(errno.ENOSPC, os.strerror(errno.ENOSPC), path)
+
+
+def test_enospc_in_scratch_retries_on_disk(scratch):
+    scratch, work_dir = scratch
+    part = os.path.join(scratch["dir"], "part_000.mp4")
+    seen = []
+
+    def stage(path):
+        seen.append(path)
+        if len(seen) == 1:
+            raise no_space(path)
+        return path
+
+    result = pipeline.retry_on_disk(scratch, work_dir, stage, part)
+
+    assert scratch["location"] == "disk"
+    assert result == os.path.join(work_dir, "temp_parts", "part_000.mp4")
+
+
+def test_enospc_in_work_dir_is_raised(scratch):
+    """Итоговый файл пишется в work_dir — перенос промежуточных файлов тут не поможет"""
+    scratch, work_dir = scratch
+    final_out = os.path.join(work_dir, "final.mp4")
+
+    def stage():
+        raise no_space(final_out)
+
+    with pytest.raises(OSError):
+        pipeline.retry_on_disk(scratch, work_dir, stage)
+    assert scratch["location"] == "scratch"
+
+
+def test_ffmpeg_enospc_without_path_checks_free_space(scratch, monkeypatch):
+    scratch, work_dir = scratch
+    error = Exception("FFmpeg error: av_interleaved_write_frame(): No space left on device")
+
+    assert not pipeline.scratch_out_of_space(scratch, error)
+    monkeypatch.setattr(pipeline, "SCRATCH_FULL_FREE", float("inf"))
+    assert pipeline.scratch_out_of_space(scratch, error)
@@ -0,0 +1,46 @@
+"""Рендер сегментами совпадает с рендером одним процессом: кадры, синхронность, стыки"""
+import os
+
+import pytest
+
+import pipeline
+from benchmark import SEAM_MIN_PSNR, bench_segments
+
+
+@pytest.fixture
+def work_dir(tmp_path, monkeypatch):
+    """Рабочая директория теста; кэши и запись о FFmpeg тоже в tmp_path"""
+    monkeypatch.setattr(pipeline, "WORK_DIR", str(tmp_path))
+    if not pipeline.check_ffmpeg_available():
+        pytest.skip("FFmpeg/FFprobe недоступны (REPLICATOR_FFMPEG / REPLICATOR_FFPROBE)")
+    os.makedirs(tmp_path / "job" / "video")
+    return str(tmp_path / "job")
+
+
+def test_segmented_render_matches_whole(work_dir):
+    """Короткий клип с ключевым кадром каждую секунду, сегменты по 1 с"""
+    results = bench_segments(4, 1, 2, work_dir, "draft", size="320x180", gop=25)
+
+    assert results["segments"] > 1
+    assert results["frames"]["segmented"] == results["frames"]["whole"]
+    assert results["av_drift_delta_s"] == 0
+    assert results["min_seam_psnr"] >= SEAM_MIN_PSNR
+
+
+def test_segmented_render_with_fps_conversion(work_dir):
+    """Клип 30 к/с в ролике 25 к/с, ключевые кадры каждые 1,9 с (47,5 выходных кадра)"""
+    results = bench_segments(8, 1, 2, work_dir, "draft", size="320x180", gop=57, rate=30, target_rate=25)
+
+    assert results["segments"] > 1
+    assert results["frames"]["segmented"] == results["frames"]["whole"]
+    assert results["av_drift_delta_s"] == 0
+    assert results["min_seam_psnr"] >= SEAM_MIN_PSNR
+
+
+def test_plan_segments_whole_output_frames():
+    """При смене частоты граница ставится только там, где до неё целое число выходных кадров"""
+    keyframes = [1.9, 3.8, 5.7, 7.6]
+
+    assert pipeline.plan_segments(keyframes, 8.5, 1) == [(0.0, 1.9), (1.9, 3.8), (3.8, 5.7), (5.7, 7.6), (7.6, None)]
+    bounds = [start for start, _ in pipeline.plan_segments(keyframes, 8.5, 1, fps=25)]
+    assert bounds == [0.0, 3.8, 7.6]
@@ -0,0 +1,67 @@
+"""План таймлайна под длину озвучки: обрезка и повтор частей"""
+import pytest
+
+from pipeline import plan_timeline, single_pass_inputs, write_concat_list
+
+
+def test_audio_shorter_than_video_trims_last_part():
+    """Озвучка короче видео — лишние части не берутся, последняя обрезается"""
+    assert plan_timeline([4.0, 4.0, 4.0], 6.0) == [(0, None), (1, 2.0)]
+
+
+def test_audio_equal_to_video_takes_all_parts():
+    assert plan_timeline([4.0, 3.0], 7.0) == [(0, None), (1, None)]
+
+
+def test_audio_longer_than_video_loops_parts():
+    """Озвучка длиннее видео — части идут по кругу, последний кусок обрезается"""
+    assert plan_timeline([4.0, 3.0], 16.5) == [(0, None), (1, None), (0, None), (1, None), (0, 2.5)]
+
+
+def test_plan_covers_target_exactly():
+    durations = [2.34, 5.1, 0.77]
+    plan = plan_timeline(durations, 31.234)
+    covered = sum(durations[i] if outpoint is None else outpoint for i, outpoint in plan)
+    assert covered == pytest.approx(31.234, abs=0.001)
+
+
+def test_zero_length_parts_are_skipped():
+    assert plan_timeline([0.0, 3.0], 5.0) == [(1, None), (1, 2.0)]
+
+
+def test_without_durations_all_parts_are_kept():
+    assert plan_timeline([0.0, 0.0], 10.0) == [(0, None), (1, None)]
+    assert plan_timeline([], 10.0) == []
+
+
+def test_concat_list_has_outpoint_only_for_trimmed_part(tmp_path):
+    parts = [str(tmp_path / "part_000.mp4"), str(tmp_path / "part_001.mp4")]
+    list_txt = write_concat_list(str(tmp_path / "list.txt"), parts, plan_timeline([4.0, 3.0], 9.0))
+    lines = open(list_txt).read().splitlines()
+    assert [line for line in lines if line.startswith("file")] == [
+        f"file '{parts[0]}'", f"file '{parts[1]}'", f"file '{parts[0]}'",
+    ]
+    assert [line for line in lines if line.startswith("outpoint")] == ["outpoint 2.000"]
+
+
+def clip_info(width, height, fps=25.0):
+    video = {"codec": "h264", "profile": "High", "pix_fmt": "yuv420p", "width": width, "height": height,
+             "fps": fps, "sar": "1:1"}
+    return {"video": video, "audio": None}
+
+
+def test_single_pass_repeats_of_one_format_use_one_input():
+    """Час озвучки на 10-секундных клипах — один вход concat-демуксера, а не ~360 входов -i"""
+    plan = plan_timeline([10.0, 10.0], 3600.0)
+    infos = [clip_info(1280, 720), clip_info(1280, 720)]
+
+    assert len(plan) == 360
+    assert single_pass_inputs(infos, plan, use_voice=True) == 1
+
+
+def test_single_pass_mixed_formats_need_input_per_piece():
+    plan = plan_timeline([10.0, 10.0], 3600.0)
+    infos = [clip_info(1280, 720), clip_info(1920, 1080, fps=30.0)]
+
+    assert single_pass_inputs(infos, plan, use_voice=True) == 360
+    assert single_pass_inputs(infos, [(0, None), (1, None)], use_voice=False) == 2
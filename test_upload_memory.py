@@ -0,0 +1,29 @@
+"""Память при сохранении загрузок: save_upload и освобождение загрузчика"""
+import os
+import sys
+
+import pytest
+
+from benchmark import measure_upload
+
+SIZE_MB = 64
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="RSS читается из /proc (Linux)")
+
+
+def test_save_upload_streams_and_releases(tmp_path):
+    """save_upload пишет загрузку кусками, после освобождения загрузчика байты не остаются в памяти"""
+    dst = tmp_path / "source1.mp4"
+    result = measure_upload(SIZE_MB, "stream", str(dst))
+
+    assert os.path.getsize(dst) == SIZE_MB * 2 ** 20
+    assert result["upload_mb"] > SIZE_MB * 0.9
+    assert result["save_extra_mb"] < 16
+    assert result["retained_mb"] < 16
+
+
+def test_buffer_write_keeps_upload(tmp_path):
+    """Прежний код (getbuffer без освобождения) копирует загрузку и держит её — замер это видит"""
+    result = measure_upload(SIZE_MB, "buffer", str(tmp_path / "source1.mp4"))
+
+    assert result["retained_mb"] > SIZE_MB * 0.9
@@ -0,0 +1,161 @@
+"""Изолированные рабочие директории задач.
+
+Каждая сессия (или задача) получает свою директорию под WORK_DIR/workspaces с
+подпапками video/ и audio/, поэтому одновременные пользователи не перезаписывают
+файлы друг друга. Брошенные директории удаляются по TTL, общий объём
+ограничен квотой. Директории задач в очереди и в работе (jobs.py) не удаляются.
+"""
+import os
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import threading
+
+import jobs
+import pipeline
+from render_cache import link_or_copy
+
+WORKSPACE_TTL = 6 * 3600  # удалять директории без активности дольше 6 часов
+WORKSPACES_QUOTA = 20 * 1024 ** 3  # 20 ГБ на все рабочие директории
+QUOTA_MIN_IDLE = 900  # по квоте удаляем только директории без активности 15+ минут
+REAP_INTERVAL = 300  # не чаще раза в 5 минут
+
+logger = logging.getLogger(__name__)
+
+_reap_lock = threading.Lock()
+_last_reap = 0.0
+
+
+def get_workspaces_root():
+    """Корень рабочих директорий"""
+    return os.path.join(pipeline.WORK_DIR, "workspaces")
+
+
+def create_workspace(root=None):
+    """Создать новую уникальную рабочую директорию и вернуть её путь"""
+    root = root or get_workspaces_root()
+    path = os.path.join(root, uuid.uuid4().hex)
+    for folder in ["video", "audio"]:
+        os.makedirs(os.path.join(path, folder), exist_ok=True)
+    return path
+
+
+def snapshot_workspace(src, root=None):
+    """Новая рабочая директория с копией входных файлов src (жёсткие ссылки).
+
+    Задача в очереди работает со снимком, поэтому новые загрузки в сессии
+    не меняют её входные данные.
+    """
+    dst = create_workspace(root)
+    for folder in ["video", "audio"]:
+        src_dir = os.path.join(src, folder)
+        if not os.path.isdir(src_dir):
+            continue
+        for name in os.listdir(src_dir):
+            link_or_copy(os.path.join(src_dir, name), os.path.join(dst, folder, name))
+    return dst
+
+
+def touch_workspace(path):
+    """Отметить активность, чтобы директорию не удалил сборщик"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def get_dir_size(path):
+    """Размер директории в байтах"""
+    total = 0
+    for dirpath, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def list_workspaces(root=None):
+    """Рабочие директории в порядке от давно неактивных к свежим: (mtime, путь)"""
+    root = root or get_workspaces_root()
+    if not os.path.isdir(root):
+        return []
+    entries = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.isdir(path):
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+    return sorted(entries)
+
+
+def protected_workspaces(keep=(), db_path=None):
+    """keep и директории задач в очереди и в работе; None — база очереди недоступна"""
+    try:
+        return set(keep) | jobs.get_active_work_dirs(db_path)
+    except sqlite3.Error as e:
+        logger.error(f"Не удалось прочитать очередь задач, очистка рабочих директорий пропущена: {e}")
+        return None
+
+
+def reap_workspaces(ttl=WORKSPACE_TTL, root=None, keep=(), db_path=None):
+    """Удалить директории, неактивные дольше ttl секунд. Возвращает число удалённых"""
+    keep = protected_workspaces(keep, db_path)
+    if keep is None:
+        return 0
+    now = time.time()
+    removed = 0
+    for mtime, path in list_workspaces(root):
+        if now - mtime > ttl and path not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    if removed:
+        logger.info(f"Удалено брошенных рабочих директорий: {removed}")
+    return removed
+
+
+def enforce_quota(max_bytes=WORKSPACES_QUOTA, root=None, keep=(), min_idle=QUOTA_MIN_IDLE, db_path=None):
+    """Удалять самые давно неактивные директории, пока общий объём больше квоты.
+
+    Директории из keep (текущая сессия), задач в очереди и в работе и активные
+    последние min_idle секунд не трогаем. Возвращает итоговый объём.
+    """
+    now = time.time()
+    entries = [(mtime, path, get_dir_size(path)) for mtime, path in list_workspaces(root)]
+    total = sum(size for _, _, size in entries)
+    keep = protected_workspaces(keep, db_path)
+    for mtime, path, size in entries:
+        if total <= max_bytes or keep is None:
+            break
+        if path in keep or now - mtime < min_idle:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        logger.info(f"Квота рабочих директорий: удалена {path}")
+    return total
+
+
+def check_quota(max_bytes=WORKSPACES_QUOTA, root=None, keep=()):
+    """Освободить место по квоте, а если не удалось — отказать в новой работе"""
+    total = enforce_quota(max_bytes, root, keep)
+    if total > max_bytes:
+        raise Exception(
+            f"Недостаточно места для задач: занято {total / 1024 ** 3:.1f} ГБ "
+            f"из {max_bytes / 1024 ** 3:.1f} ГБ. Попробуйте позже."
+        )
+    return total
+
+
+def maybe_reap(ttl=WORKSPACE_TTL, interval=REAP_INTERVAL, root=None, keep=()):
+    """Запустить сборщик, если с прошлого запуска прошло больше interval секунд"""
+    global _last_reap
+    with _reap_lock:
+        if time.time() - _last_reap < interval:
+            return 0
+        _last_reap = time.time()
+    return reap_workspaces(ttl, root, keep)